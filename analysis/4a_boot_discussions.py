@@ -4,45 +4,23 @@ import pickle as pkl
 from os.path import join
 import numpy as np
 import statsmodels.api as sm
-import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
+from ols_engine import (factorize_design, split_complete_cases, fit_design,
+                        fit_multi, share_arrays, release_arrays,
+                        bootstrap_block)
+from boot_store import open_store, is_done, save_unit, export_store
+from matched_data import read_data
 
-np.random.seed(63)
+SEED = 63
 
 pd.options.display.float_format = '{:.5f}'.format
 pd.options.mode.chained_assignment = None
 
 
 N_ITER = 10000
-
-src = sys.argv[1] 
-dst = "./replies/"
-
-if not Path(dst).exists():
-    Path(dst).mkdir(parents=True)
-
-
-with open(join(src, "dtypes_config.pickle"), "rb") as file:
-    DTYPES = pkl.load(file)
-
-def read_data(data_dir, pattern):
-    for file_path in Path(data_dir).glob(pattern):
-        try:
-            print(f"Processing file: {file_path}")
-            df = pd.read_csv(file_path, dtype=DTYPES)
-            df["Rating"] = pd.to_numeric(df["Rating"], errors="coerce")
-            df["Bias"] = pd.to_numeric(df["Orientation"], errors="coerce")
-            df.drop(columns=["Orientation"], inplace=True)
-            df.drop(columns=["Unnamed: 0"], inplace=True)
-            df.columns = df.columns.str.replace("author.", "",
-                                                regex=True)
-            df.columns = df.columns.str.capitalize()
-            return df
-        except Exception as e:
-            print(f"Error processing file {file_path}: {e}")
-    
-replies = read_data(src, "matched_replies_mahalanobis.csv")
-first = read_data(src, "matched_replies_first_mahalanobis.csv")
+CHUNK_SIZE = 100 #bootstrap iterations per DV solved in one batch
 
 #define relevant columns
 IV = "Rating"
@@ -64,131 +42,153 @@ COVARIATES_FIRST = ["Bias",
                     "Tweet_count_first_log"]
 
 
-
-#filter data
-reply_columns = [IV] + DVS_REPLIES + COVARIATES
-df_replies = replies[reply_columns] 
-
-first_columns = [IV] + DVS_FIRST + COVARIATES_FIRST
-df_first = first[first_columns]
-
-
 def fit_models(df, dvs, iv, covariates, coeff_path):
-    coefficients_df = pd.DataFrame(
-        columns=["DV", "Coefficient", "SE",
-                 "CI_Lower", "CI_Upper",
-                 "P-Value", "R-Squared", 
-                 "Cond_Mean"])
-    models = []
-    
-    for dv in dvs:
-        X = df[[iv] + covariates]
-        X = sm.add_constant(X)
-        y = df[dv]
-
-        model = sm.OLS(y, X).fit()
-        models.append(model)
-
-        #extract the model params
-        coef_score = model.params[iv]
-        se = model.bse[iv]
-        ci_lower, ci_upper = model.conf_int().loc[iv]
-        p_value = model.pvalues[iv]
-        r_squared = model.rsquared
+    X = sm.add_constant(df[[iv] + covariates])
+    col = X.columns.get_loc(iv)
+    coefficients = []
+
+    # solve all DVs with the same complete cases against one factorization
+    for rows, group_dvs in split_complete_cases(X, df[dvs]):
+        design = factorize_design(X[rows])
+        fit = fit_multi(design, df.loc[rows, group_dvs])
 
         #calculate conditional mean
-        intercept = model.params["const"]
+        params = pd.DataFrame(fit["params"], index=X.columns, columns=group_dvs)
         mean_cov_values = df[covariates].mean()
-        mean_cov_effects = (mean_cov_values * model.params[covariates]).sum()
-        cond_mean = intercept + mean_cov_effects
+        mean_cov_effects = mean_cov_values @ params.loc[covariates]
+        cond_mean = params.loc["const"] + mean_cov_effects
 
         #save the results
-        coefficients_df = pd.concat(
-            [coefficients_df, pd.DataFrame({
-                "DV": [dv],
-                "Coefficient": [coef_score],
-                "SE": [se],
-                "CI_Lower": [ci_lower],
-                "CI_Upper": [ci_upper],
-                "P-Value": [p_value],
-                "R-Squared": [r_squared],
-                "Cond_Mean": [cond_mean]
-            })], ignore_index=True)
-        
+        coefficients.append(pd.DataFrame({
+            "DV": group_dvs,
+            "Coefficient": fit["params"][col],
+            "SE": fit["bse"][col],
+            "CI_Lower": fit["ci_lower"][col],
+            "CI_Upper": fit["ci_upper"][col],
+            "P-Value": fit["pvalues"][col],
+            "R-Squared": fit["rsquared"],
+            "Cond_Mean": cond_mean.values
+        }))
+
+    coefficients_df = pd.concat(coefficients, ignore_index=True)\
+                        .set_index("DV").loc[dvs].reset_index()
     coefficients_df.to_csv(coeff_path, index=False)
 
 
-def residual_bootstrap(df, dvs, iv, covariates, n_iter, output_file):
-
-    bootstrap_results = []
-    
-    for dv in tqdm(dvs, desc="Residual Bootstrapping DVs"):
-        # fit original model 
-        X = df[[iv] + covariates].copy()
-        X = sm.add_constant(X)
-        y = df[dv].copy()
-        
-        # remove missing values
-        combined = pd.concat([X, y], axis=1).dropna()
-        X_clean = combined.iloc[:, :-1]
-        y_clean = combined.iloc[:, -1]
-        
-        og_model = sm.OLS(y_clean, X_clean).fit()
-        
-        # extract fitted values and residuals
-        y_fitted = og_model.fittedvalues
-        residuals = og_model.resid
-        
-        # bootstrap residuals
-        for i in range(n_iter):
-            # sample residuals with replacement
-            bootstrap_residuals = np.random.choice(residuals, size=len(residuals), replace=True)
-            
-            # generate new Y values: Y_new = Y_fitted + bootstrap_residuals
-            y_bootstrap = y_fitted + bootstrap_residuals
-            
-            # re-estimate model with new Y but same X
-            bootstrap_model = sm.OLS(y_bootstrap, X_clean).fit()
-            
-            # extract coefficient for IV
-            coefficient = bootstrap_model.params[iv]
-            ci_lower = bootstrap_model.conf_int().loc[iv, 0]
-            ci_upper = bootstrap_model.conf_int().loc[iv, 1]
-            
-            result = {
-                "DV": dv,
-                "Coefficient_boot": coefficient,
-                "CI_Lower_boot": ci_lower,
-                "CI_Upper_boot": ci_upper
-            }
-            bootstrap_results.append(result)
-            
-            # save periodically
-            if (i + 1) % 100 == 0 or (dv == dvs[-1] and i == n_iter - 1):
-                pd.DataFrame(bootstrap_results).to_csv(output_file, 
-                                                       index=False, 
-                                                       mode='a', 
-                                                       header=not Path(output_file).exists())
-                bootstrap_results = []
-
-print("Computing full models for replies")
-fit_models(df_replies, DVS_REPLIES, IV, COVARIATES, 
-           join(dst, "replies_coeffs.csv"))
-
-print("Computing full models for first replies")
-fit_models(df_first, DVS_FIRST, IV, COVARIATES_FIRST, 
-              join(dst, "replies_first_coeffs.csv"))
-print("Residual Bootstrapping for replies")
-residual_bootstrap(df_replies, 
-                      DVS_REPLIES, IV, COVARIATES, 
-                      N_ITER, 
-                      join(dst, "replies_res_boot.csv"))
-
-print("Residual Bootstrapping for first")
-residual_bootstrap(df_first, 
-                      DVS_FIRST, IV, COVARIATES_FIRST, 
-                      N_ITER,
-                      join(dst, "replies_first_res_boot.csv"))
-
-
-print("Saved results.")
+def residual_bootstrap(df, dvs, iv, covariates, n_iter, store_dir, output_file,
+                       chunk_size=CHUNK_SIZE, workers=1, seed=SEED):
+    X = sm.add_constant(df[[iv] + covariates])
+    col = X.columns.get_loc(iv)
+    n_blocks = (n_iter - 1) // chunk_size + 1
+
+    # completed (DV, block) units are read from the checkpoint and skipped
+    store = open_store(store_dir, {"seed": seed, "n_iter": n_iter,
+                                   "chunk_size": chunk_size, "iv": iv,
+                                   "covariates": covariates, "dvs": dvs})
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+
+    try:
+        # remove missing values: DVs with the same complete cases share one X
+        for rows, group_dvs in split_complete_cases(X, df[dvs]):
+            # split the pending DVs of each block across the workers; the
+            # position of each DV in ``dvs`` and the block fix its random stream
+            tasks = []
+            for block in range(n_blocks):
+                pending = [i for i, dv in enumerate(group_dvs)
+                           if not is_done(store, dv, block)]
+                if not pending:
+                    continue
+                for dv_rows in np.array_split(pending, min(workers, len(pending))):
+                    dv_rows = dv_rows.tolist()
+                    tasks.append((dv_rows, [dvs.index(group_dvs[i]) for i in dv_rows],
+                                  block, min(chunk_size, n_iter - block * chunk_size)))
+            if not tasks:
+                continue
+
+            # factor X once and extract fitted values and residuals of all DVs
+            design = factorize_design(X[rows])
+            _, y_fitted, residuals = fit_design(design, df.loc[rows, group_dvs])
+            arrays = {"X": design["X"], "pinv_X": design["pinv_X"],
+                      "normalized_cov": design["normalized_cov"],
+                      "y_fitted": y_fitted.T, # (n_dv x n_obs)
+                      "residuals": residuals.T}
+
+            # workers read the arrays from shared memory instead of pickles
+            blocks, specs = share_arrays(arrays) if pool else ([], arrays)
+            try:
+                args = [(specs, dv_rows, dv_pos, block, n_chunk, col,
+                         design["df_resid"], seed)
+                        for dv_rows, dv_pos, block, n_chunk in tasks]
+                results = pool.map(bootstrap_block, *zip(*args)) if pool \
+                    else map(bootstrap_block, *zip(*args))
+
+                # bootstrap residuals block by block to keep memory bounded,
+                # and checkpoint every (DV, block) unit as soon as it is done
+                for (dv_rows, dv_pos, block, _), (coefficient, ci_lower, ci_upper) \
+                        in tqdm(zip(tasks, results), total=len(tasks),
+                                desc=f"Residual Bootstrapping {len(group_dvs)} DVs"):
+                    for j, (i, pos) in enumerate(zip(dv_rows, dv_pos)):
+                        save_unit(store, group_dvs[i], block, (pos, block),
+                                  coefficient[j], ci_lower[j], ci_upper[j])
+            finally:
+                release_arrays(blocks)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    export_store(store, output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", help="data directory")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes for the bootstrap")
+    args = parser.parse_args()
+
+    src = args.src
+    dst = "./replies/"
+
+    if not Path(dst).exists():
+        Path(dst).mkdir(parents=True)
+
+    with open(join(src, "dtypes_config.pickle"), "rb") as file:
+        dtypes = pkl.load(file)
+
+    replies = read_data(src, "matched_replies_mahalanobis.csv", dtypes)
+    first = read_data(src, "matched_replies_first_mahalanobis.csv", dtypes)
+
+    #filter data
+    reply_columns = [IV] + DVS_REPLIES + COVARIATES
+    df_replies = replies[reply_columns]
+
+    first_columns = [IV] + DVS_FIRST + COVARIATES_FIRST
+    df_first = first[first_columns]
+
+    print("Computing full models for replies")
+    fit_models(df_replies, DVS_REPLIES, IV, COVARIATES,
+               join(dst, "replies_coeffs.csv"))
+
+    print("Computing full models for first replies")
+    fit_models(df_first, DVS_FIRST, IV, COVARIATES_FIRST,
+                  join(dst, "replies_first_coeffs.csv"))
+    print("Residual Bootstrapping for replies")
+    residual_bootstrap(df_replies,
+                          DVS_REPLIES, IV, COVARIATES,
+                          N_ITER,
+                          join(dst, "replies_res_boot"),
+                          join(dst, "replies_res_boot.parquet"),
+                          workers=args.workers)
+
+    print("Residual Bootstrapping for first")
+    residual_bootstrap(df_first,
+                          DVS_FIRST, IV, COVARIATES_FIRST,
+                          N_ITER,
+                          join(dst, "replies_first_res_boot"),
+                          join(dst, "replies_first_res_boot.parquet"),
+                          workers=args.workers)
+
+    print("Saved results.")
+
+if __name__ == "__main__":
+    main()
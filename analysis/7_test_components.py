@@ -7,6 +7,8 @@ import numpy as np
 import statsmodels.api as sm
 import sys
 from tqdm import tqdm
+from ols_engine import factorize_design, split_complete_cases, fit_multi
+from matched_data import read_data
 
 np.random.seed(63)
 
@@ -26,24 +28,8 @@ with open(join(src, "dtypes_config.pickle"), "rb") as file:
     DTYPES = pkl.load(file)
 
 
-def read_data(data_dir, pattern):
-    for file_path in Path(data_dir).glob(pattern):
-        try:
-            print(f"Processing file: {file_path}")
-            df = pd.read_csv(file_path, dtype=DTYPES)
-            df["Rating"] = pd.to_numeric(df["Rating"], errors="coerce")
-            df["Bias"] = pd.to_numeric(df["Orientation"], errors="coerce")
-            df.drop(columns=["Orientation"], inplace=True)
-            df.drop(columns=["Unnamed: 0"], inplace=True)
-            df.columns = df.columns.str.replace("author.", "",
-                                                regex=True)
-            df.columns = df.columns.str.capitalize()
-            return df
-        except Exception as e:
-            print(f"Error processing file {file_path}: {e}")
-    
-replies = read_data(src, "matched_replies_mahalanobis.csv")
-first = read_data(src, "matched_replies_first_mahalanobis.csv")
+replies = read_data(src, "matched_replies_mahalanobis.csv", DTYPES)
+first = read_data(src, "matched_replies_first_mahalanobis.csv", DTYPES)
 
 criteria = pd.read_csv(join(src,"newsguard_criteria.csv"),
                        dtype=DTYPES)
@@ -112,35 +98,27 @@ for crit in CRITERIA:
     df_first[crit] = df_first[crit].replace({"Yes": 0, "No": 1}) #misinfo is treatment
 
 def compute_full_models(df, dvs, iv, covariates, coeff_path):
-    coefficients_df = pd.DataFrame(
-        columns=["DV", "Coefficient", "SE",
-                 "CI_Lower", "CI_Upper",
-                 "P-Value", "R-Squared"])
-
-    for dv in dvs:
-        X = df[[iv] + covariates]
-        X = sm.add_constant(X)
-        y = df[dv]
-        model = sm.OLS(y, X).fit()
-
-        #extract the model params
-        coef_score = model.params[iv]
-        se = model.bse[iv]
-        ci_lower, ci_upper = model.conf_int().loc[iv]
-        p_value = model.pvalues[iv]
-        r_squared = model.rsquared
+    X = sm.add_constant(df[[iv] + covariates])
+    col = X.columns.get_loc(iv)
+    coefficients = []
+
+    # solve all DVs with the same complete cases against one factorization
+    for rows, group_dvs in split_complete_cases(X, df[dvs]):
+        fit = fit_multi(factorize_design(X[rows]), df.loc[rows, group_dvs])
 
         #save the results
-        coefficients_df = pd.concat(
-            [coefficients_df, pd.DataFrame({
-                "DV": [dv],
-                "Coefficient": [coef_score],
-                "SE": [se],
-                "CI_Lower": [ci_lower],
-                "CI_Upper": [ci_upper],
-                "P-Value": [p_value],
-                "R-Squared": [r_squared]
-            })], ignore_index=True)
+        coefficients.append(pd.DataFrame({
+            "DV": group_dvs,
+            "Coefficient": fit["params"][col],
+            "SE": fit["bse"][col],
+            "CI_Lower": fit["ci_lower"][col],
+            "CI_Upper": fit["ci_upper"][col],
+            "P-Value": fit["pvalues"][col],
+            "R-Squared": fit["rsquared"]
+        }))
+
+    coefficients_df = pd.concat(coefficients, ignore_index=True)\
+                        .set_index("DV").loc[dvs].reset_index()
         
     #save as csv
     coefficients_df.to_csv(coeff_path, index=False)
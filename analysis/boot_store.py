@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from pathlib import Path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_processing"))
+from storage import write_atomic
+
+## Notes:
+# Checkpointed store for the residual bootstrap in ``4a_boot_discussions.py``.
+# Every (DV, iteration block) unit is saved as its own .npy shard and recorded
+# in ``checkpoint.json`` together with the seed and spawn key of the random
+# stream it was drawn from. An interrupted run therefore resumes at the missing
+# units only, and rerunning never duplicates rows. Once all units are done,
+# the shards are exported to one Parquet file.
+
+BOOT_COLUMNS = ["Coefficient_boot", "CI_Lower_boot", "CI_Upper_boot"]
+
+
+# Step 1: Open (or create) the store and check it belongs to this run
+def open_store(store_dir, settings):
+    Path(store_dir).mkdir(parents=True, exist_ok=True)
+    checkpoint_path = os.path.join(store_dir, "checkpoint.json")
+
+    if Path(checkpoint_path).exists():
+        with open(checkpoint_path) as file:
+            checkpoint = json.load(file)
+        if checkpoint["settings"] != settings:
+            raise ValueError(f"{store_dir} was created with different settings "
+                             f"({checkpoint['settings']}); remove it to start over.")
+        print(f"Resuming from {len(checkpoint['completed'])} completed units.")
+    else:
+        checkpoint = {"settings": settings, "completed": []}
+
+    done = {(unit["dv"], unit["block"]) for unit in checkpoint["completed"]}
+    return {"dir": store_dir, "path": checkpoint_path,
+            "checkpoint": checkpoint, "done": done}
+
+
+def is_done(store, dv, block):
+    return (dv, block) in store["done"]
+
+
+# Step 2: Save one (DV, block) unit and record it in the checkpoint
+def save_unit(store, dv, block, spawn_key, coefficient, ci_lower, ci_upper):
+    values = np.stack([coefficient, ci_lower, ci_upper]) # (3 x n_chunk)
+    with write_atomic(os.path.join(store["dir"], f"{dv}_{block:05d}.npy")) as tmp_path, \
+            open(tmp_path, "wb") as file:
+        np.save(file, values)
+
+    store["checkpoint"]["completed"].append(
+        {"dv": dv, "block": block, "spawn_key": list(spawn_key)})
+    store["done"].add((dv, block))
+    with write_atomic(store["path"]) as tmp_path, open(tmp_path, "w") as file:
+        json.dump(store["checkpoint"], file)
+
+
+# Step 3: Export all units in (DV, block) order to one Parquet file
+def export_store(store, output_file):
+    settings = store["checkpoint"]["settings"]
+    n_blocks = (settings["n_iter"] - 1) // settings["chunk_size"] + 1
+    missing = [(dv, block) for dv in settings["dvs"] for block in range(n_blocks)
+               if not is_done(store, dv, block)]
+    if missing:
+        raise ValueError(f"{len(missing)} bootstrap units are missing in {store['dir']}.")
+
+    frames = []
+    for dv in settings["dvs"]:
+        values = np.concatenate(
+            [np.load(os.path.join(store["dir"], f"{dv}_{block:05d}.npy"))
+             for block in range(n_blocks)], axis=1)
+        df = pd.DataFrame(values.T, columns=BOOT_COLUMNS)
+        df.insert(0, "DV", dv)
+        frames.append(df)
+
+    with write_atomic(output_file) as tmp_path:
+        pd.concat(frames, ignore_index=True).to_parquet(tmp_path, index=False)
@@ -0,0 +1,83 @@
+import glob
+import hashlib
+import json
+import os
+import sys
+import pyarrow as pa
+import pyarrow.feather as feather
+import pandas as pd
+from pathlib import Path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_processing"))
+from storage import write_atomic
+
+## Notes:
+# Shared loader of the matched datasets (``matched_replies_*_mahalanobis.csv``)
+# for ``4a_boot_discussions.py`` and ``7_test_components.py``. The csv is
+# parsed and normalized (numeric Rating and Bias, R row names dropped, columns
+# renamed) once; the normalized frame is cached as an uncompressed Feather
+# file in ``<data_dir>/_matched_cache/``, which later runs memory-map instead
+# of re-parsing the csv. The cache key is a hash of the csv content, the
+# dtypes and the normalization version, so the cache is rebuilt whenever the
+# source file changes; older caches of the same file are removed. If the
+# cache cannot be written (e.g. a read-only data directory), the normalized
+# frame is returned uncached.
+
+NORMALIZE_VERSION = 1 #increase when normalize changes
+CACHE_DIR = "_matched_cache"
+
+
+def normalize(df):
+    df["Rating"] = pd.to_numeric(df["Rating"], errors="coerce")
+    df["Bias"] = pd.to_numeric(df["Orientation"], errors="coerce")
+    df.drop(columns=["Orientation"], inplace=True)
+    df.drop(columns=["Unnamed: 0"], inplace=True)
+    df.columns = df.columns.str.replace("author.", "",
+                                        regex=True)
+    df.columns = df.columns.str.capitalize()
+    return df
+
+
+# Step 1: Cache key of a csv file
+def cache_key(file_path, dtypes):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 24), b""):
+            digest.update(block)
+    options = {"dtypes": {col: str(dtype) for col, dtype in (dtypes or {}).items()},
+               "version": NORMALIZE_VERSION}
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+# Step 2: Read the normalized frame from the cache, or build the cache
+def load_matched(file_path, dtypes, cache_dir):
+    stem = Path(file_path).name.split(".")[0]
+    cache_path = os.path.join(cache_dir, f"{stem}_{cache_key(file_path, dtypes)}.feather")
+    if os.path.exists(cache_path):
+        return feather.read_table(cache_path, memory_map=True).to_pandas()
+
+    df = normalize(pd.read_csv(file_path, dtype=dtypes))
+    try:
+        write_cache(df, cache_dir, stem, cache_path)
+    except (OSError, pa.ArrowException) as e:
+        print(f"Could not cache {file_path} in {cache_dir}: {e}")
+    return df
+
+
+def write_cache(df, cache_dir, stem, cache_path):
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    with write_atomic(cache_path) as tmp_path:
+        feather.write_feather(df, tmp_path, compression="uncompressed")
+    for stale in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(stem)}_*.feather")):
+        if stale != cache_path:
+            os.remove(stale)
+
+
+def read_data(data_dir, pattern, dtypes, cache_dir=None):
+    cache_dir = cache_dir or os.path.join(data_dir, CACHE_DIR)
+    for file_path in Path(data_dir).glob(pattern):
+        try:
+            print(f"Processing file: {file_path}")
+            return load_matched(file_path, dtypes, cache_dir)
+        except Exception as e:
+            print(f"Error processing file {file_path}: {e}")
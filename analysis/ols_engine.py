@@ -0,0 +1,168 @@
+import numpy as np
+from multiprocessing import shared_memory, util
+from scipy import stats
+
+## Notes:
+# Closed-form OLS for ``4a_boot_discussions.py`` and ``7_test_components.py``.
+# The design matrix X is the same for every emotion DV and never changes
+# between bootstrap iterations, so it is factored once (pseudo-inverse, like
+# ``sm.OLS(...).fit()``) and all DVs (and all bootstrap replicates
+# y* = y_fitted + e*) are solved as one matrix product against it.
+# For ``--workers N``, bootstrap blocks run in a process pool: every
+# (DV, iteration block) draws from its own SeedSequence-spawned generator, so
+# results do not depend on the number of workers, and the read-only arrays are
+# passed to the workers through shared memory instead of being pickled.
+
+
+# Step 1: Factor the design matrix once
+def factorize_design(X):
+    X = np.asarray(X, dtype=float)
+    pinv_X = np.linalg.pinv(X) # (n_params x n_obs), same as statsmodels "pinv"
+    normalized_cov = pinv_X @ pinv_X.T # (X'X)^-1
+    df_resid = X.shape[0] - np.linalg.matrix_rank(X)
+    # R-squared is centered if X contains a constant (as in statsmodels)
+    has_const = bool(np.any((np.ptp(X, axis=0) == 0) & (X[0] != 0)))
+    return {"X": X, "pinv_X": pinv_X,
+            "normalized_cov": normalized_cov,
+            "df_resid": df_resid,
+            "has_const": has_const}
+
+
+# Step 2: Group DVs with the same complete cases, so that each group
+# can be solved against one factorization of X
+def split_complete_cases(X, Y):
+    X_missing = X.isna().any(axis=1)
+    groups = {}
+    for dv in Y.columns:
+        rows = ~(X_missing | Y[dv].isna())
+        groups.setdefault(rows.values.tobytes(), (rows, []))[1].append(dv)
+    return list(groups.values())
+
+
+# Step 3: Fit the original model(s) for one or several DVs
+def fit_design(design, Y):
+    # Y is (n_obs,) for a single DV or (n_obs x n_dv) for several DVs
+    Y = np.asarray(Y, dtype=float)
+    params = design["pinv_X"] @ Y
+    y_fitted = design["X"] @ params
+    residuals = Y - y_fitted
+    return params, y_fitted, residuals
+
+
+# Step 4: Full set of model statistics for several DVs at once
+def fit_multi(design, Y, alpha=0.05):
+    Y = np.asarray(Y, dtype=float)
+    params, _, residuals = fit_design(design, Y)
+    df_resid = design["df_resid"]
+
+    ssr = np.einsum("ij,ij->j", residuals, residuals)
+    bse = np.sqrt(np.outer(np.diag(design["normalized_cov"]), ssr / df_resid))
+    tvalues = params / bse
+    q = stats.t.ppf(1 - alpha / 2, df_resid)
+
+    Y_centered = Y - Y.mean(axis=0) if design["has_const"] else Y
+    tss = np.einsum("ij,ij->j", Y_centered, Y_centered)
+
+    # all arrays are (n_params x n_dv), except for the R-squared (n_dv,)
+    return {"params": params,
+            "bse": bse,
+            "ci_lower": params - q * bse,
+            "ci_upper": params + q * bse,
+            "pvalues": 2 * stats.t.sf(np.abs(tvalues), df_resid),
+            "rsquared": 1 - ssr / tss}
+
+
+# Step 5: Solve a chunk of bootstrap replicates for all DVs at once
+def bootstrap_chunk(design, y_fitted, residuals, idx, col, alpha=0.05):
+    # y_fitted and residuals are (n_dv x n_obs), idx holds the resampled
+    # residual positions as (n_dv x n_chunk x n_obs)
+    resampled = np.take_along_axis(residuals[:, None, :], idx, axis=2)
+    Y = y_fitted[:, :, None] + resampled.transpose(0, 2, 1) # (n_dv x n_obs x n_chunk)
+    params = design["pinv_X"] @ Y
+    resid = Y - design["X"] @ params
+
+    # standard errors and t-based CIs as in ``conf_int()``
+    sigma2 = np.einsum("dij,dij->dj", resid, resid) / design["df_resid"]
+    se = np.sqrt(sigma2 * design["normalized_cov"][col, col])
+    q = stats.t.ppf(1 - alpha / 2, design["df_resid"])
+
+    # all arrays are (n_dv x n_chunk)
+    coefficient = params[:, col, :]
+    return coefficient, coefficient - q * se, coefficient + q * se
+
+
+# Step 6: One independent random stream per DV and iteration block
+def block_rng(seed, dv_pos, block):
+    return np.random.default_rng(
+        np.random.SeedSequence(seed, spawn_key=(dv_pos, block)))
+
+
+# Step 7: Share read-only arrays with worker processes
+def share_arrays(arrays):
+    blocks, specs = [], {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        blocks.append(shm)
+        specs[name] = (shm.name, arr.shape, arr.dtype.str)
+    return blocks, specs
+
+
+def release_arrays(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+# segments of the current task group attached by this (worker) process, kept
+# open for its later tasks; segments of an earlier group are closed as soon as
+# a task of a new group arrives, the last ones when the worker exits
+_ATTACHED = {}
+_FINALIZER = None
+
+def _close_attached(keep=()):
+    for shm_name in [name for name in _ATTACHED if name not in keep]:
+        shm, arr = _ATTACHED.pop(shm_name)
+        del arr # the view must be gone before the segment is closed
+        shm.close()
+
+
+def attach_arrays(specs):
+    global _FINALIZER
+    if _FINALIZER is None:
+        _FINALIZER = util.Finalize(None, _close_attached, exitpriority=10)
+    names = {spec[0] for spec in specs.values() if not isinstance(spec, np.ndarray)}
+    _close_attached(keep=names)
+
+    arrays = {}
+    for name, spec in specs.items():
+        # in-process runs pass the arrays themselves
+        if isinstance(spec, np.ndarray):
+            arrays[name] = spec
+            continue
+        shm_name, shape, dtype = spec
+        if shm_name not in _ATTACHED:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            _ATTACHED[shm_name] = (shm, np.ndarray(shape, dtype=dtype,
+                                                   buffer=shm.buf))
+        arrays[name] = _ATTACHED[shm_name][1]
+    return arrays
+
+
+# Step 8: Bootstrap one iteration block for a subset of DVs (pool task)
+def bootstrap_block(specs, dv_rows, dv_pos, block, n_chunk, col, df_resid,
+                    seed):
+    arrays = attach_arrays(specs)
+    design = {"X": arrays["X"], "pinv_X": arrays["pinv_X"],
+              "normalized_cov": arrays["normalized_cov"],
+              "df_resid": df_resid}
+    y_fitted = arrays["y_fitted"][dv_rows]
+    residuals = arrays["residuals"][dv_rows]
+    n_obs = residuals.shape[1]
+
+    # sample residuals with replacement, from each DV's own stream
+    idx = np.stack([block_rng(seed, pos, block)
+                    .integers(0, n_obs, size=(n_chunk, n_obs))
+                    for pos in dv_pos])
+    return bootstrap_chunk(design, y_fitted, residuals, idx, col)
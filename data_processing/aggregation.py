@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from id_index import to_int64
+
+## Notes:
+# Per-conversation aggregates of the discussion replies in one pass. The
+# replies are sorted once by (conversation_id, created_at), so every
+# conversation is a contiguous segment of the sorted rows and each aggregate is
+# a segment reduction over the same order (np.add.reduceat, np.minimum.reduceat,
+# ...) instead of another groupby over the full reply table. As with groupby,
+# missing values are skipped: the mean is taken over the non-missing values and
+# the first reply of a column is its first non-missing value by time.
+
+EMOTIONS = ["anger", "fear", "disgust", "sadness",
+            "joy", "pride", "hope"]
+AVG_VARIABLES = EMOTIONS + ["author.tweet_count"]
+NAT = np.iinfo(np.int64).min
+
+
+# Step 1: Sort the replies into one segment per conversation
+def to_nanoseconds(created_at):
+    return pd.DatetimeIndex(pd.to_datetime(created_at)).as_unit("ns").asi8
+
+
+def conversation_segments(conversation_ids, times):
+    # missing times are sorted last, as with sort_values
+    keys = to_int64(conversation_ids)
+    order = np.lexsort((np.where(times == NAT, np.iinfo(np.int64).max, times), keys))
+    order = order[keys[order] >= 0]
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    return order, starts
+
+
+# Step 2: Segment reductions over the sorted rows
+def segment_count(starts, n_rows):
+    return np.diff(np.r_[starts, n_rows])
+
+
+def segment_mean(values, starts):
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def segment_time_range(times, starts):
+    # min and max of the int64 nanoseconds, NAT where all times are missing
+    missing = times == NAT
+    first = np.minimum.reduceat(np.where(missing, np.iinfo(np.int64).max, times), starts)
+    last = np.maximum.reduceat(times, starts)
+    return np.where(first == np.iinfo(np.int64).max, NAT, first), last
+
+
+def segment_first(values, starts):
+    # first non-missing value of each segment
+    values = pd.Series(values).reset_index(drop=True)
+    n_rows = len(values)
+    positions = np.where(values.notna().to_numpy(), np.arange(n_rows), n_rows)
+    first = np.minimum.reduceat(positions, starts)
+    found = first < np.r_[starts[1:], n_rows]
+    return values.iloc[np.minimum(first, n_rows - 1)].reset_index(drop=True).where(found)
+
+
+# Step 3: All aggregates of the replies per conversation
+def aggregate_replies(replies, variables=AVG_VARIABLES, first_columns=("id", "author_id")):
+    times = to_nanoseconds(replies["created_at"])
+    order, starts = conversation_segments(replies["conversation_id"], times)
+    rows = replies.iloc[order].reset_index(drop=True)
+    times = times[order]
+
+    aggregates = {"conversation_id": rows["conversation_id"].iloc[starts].to_numpy(),
+                  "n_replies": segment_count(starts, len(rows))}
+    for col in variables:
+        aggregates[f"{col}_avg"] = segment_mean(rows[col], starts)
+
+    first_time, last_time = segment_time_range(times, starts)
+    missing = (first_time == NAT) | (last_time == NAT)
+    aggregates["time_diff"] = np.where(missing, np.nan, (last_time - first_time) / 1e9)
+
+    for col in list(first_columns) + list(variables):
+        aggregates[f"{col}_first"] = segment_first(rows[col], starts).to_numpy()
+    return pd.DataFrame(aggregates)
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+## Notes:
+# Covariate balance of a matched sample, computed for all covariates at once
+# on the (n x covariates) matrix instead of one covariate at a time. As in the
+# MatchIt summaries (ATT), the standardized mean difference divides by the SD
+# of the treated units before matching, the variance ratio is treated over
+# control (missing for binary covariates), and the eCDF statistics are the
+# mean and max absolute difference between the treated and control eCDFs
+# over the unique values of a covariate. The matching weights are used in
+# the matched sample.
+
+
+# Step 1: Weighted means and variances per group
+def weighted_moments(X, weights):
+    total = weights.sum()
+    means = weights @ X / total
+    squares = weights @ (X - means) ** 2
+    #unbiased for frequency-like weights, the sample variance for unit weights
+    variances = squares * total / (total ** 2 - (weights ** 2).sum())
+    return means, variances
+
+
+# Step 2: eCDF differences of all covariates in one sort
+def ecdf_stats(X, treated, weights):
+    order = np.argsort(X, axis=0, kind="stable")
+    values = np.take_along_axis(X, order, axis=0)
+    treated_weights = np.where(treated, weights, 0.0)
+    control_weights = np.where(treated, 0.0, weights)
+    differences = np.abs(np.cumsum(treated_weights[order], axis=0) / treated_weights.sum()
+                         - np.cumsum(control_weights[order], axis=0) / control_weights.sum())
+
+    # the eCDFs are compared at the last row of each unique value
+    last = np.vstack([values[1:] != values[:-1], np.ones((1, X.shape[1]), dtype=bool)])
+    differences = np.where(last, differences, 0.0)
+    return differences.sum(axis=0) / last.sum(axis=0), differences.max(axis=0)
+
+
+# Step 3: Balance table of one sample
+def balance_table(X, treated, weights, treated_sd, covariates):
+    means_t, var_t = weighted_moments(X[treated], weights[treated])
+    means_c, var_c = weighted_moments(X[~treated], weights[~treated])
+    ecdf_mean, ecdf_max = ecdf_stats(X, treated, weights)
+
+    binary = np.array([len(np.unique(X[:, col])) <= 2 for col in range(X.shape[1])])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return pd.DataFrame({"covariate": covariates,
+                             "means_treated": means_t,
+                             "means_control": means_c,
+                             "std_mean_diff": (means_t - means_c) / treated_sd,
+                             "var_ratio": np.where(binary, np.nan, var_t / var_c),
+                             "ecdf_mean": ecdf_mean,
+                             "ecdf_max": ecdf_max,
+                             "n_treated": weights[treated].sum(),
+                             "n_control": weights[~treated].sum()})
+
+
+def correlations(X, covariates):
+    return pd.DataFrame(np.corrcoef(X, rowvar=False), index=covariates, columns=covariates)
+
+
+# Step 4: Balance before and after matching
+def balance_report(df, matched, treatment, covariates, weights="weights"):
+    samples = {"all": (df, np.ones(len(df))),
+               "matched": (matched, matched[weights].to_numpy(dtype=float))}
+    X_all = df[covariates].to_numpy(dtype=float)
+    treated_all = df[treatment].to_numpy() == 1
+    # standardized by the treated units before matching, for both samples
+    treated_sd = np.sqrt(weighted_moments(X_all[treated_all], np.ones(treated_all.sum()))[1])
+
+    tables, matrices = [], []
+    for sample, (data, sample_weights) in samples.items():
+        X = data[covariates].to_numpy(dtype=float)
+        treated = data[treatment].to_numpy() == 1
+        table = balance_table(X, treated, sample_weights, treated_sd, covariates)
+        table.insert(0, "sample", sample)
+        matrix = correlations(X, covariates)
+        matrix.insert(0, "sample", sample)
+        tables.append(table)
+        matrices.append(matrix)
+    return pd.concat(tables, ignore_index=True), pd.concat(matrices)
@@ -0,0 +1,48 @@
+import os
+import pandas as pd
+from storage import read_table, TableWriter
+from id_index import to_int64
+
+## Notes:
+# Hash partitioning of tables into on-disk buckets, for joins whose inputs do
+# not fit into memory together. All rows with the same key (an ID column,
+# compared as int64) land in the same bucket, so a join can be done bucket by
+# bucket. Buckets are Parquet tables named ``<prefix>_<bucket:04d>``.
+
+N_BUCKETS = 64
+
+
+def bucket_of(keys, n_buckets):
+    return pd.util.hash_array(keys) % n_buckets
+
+
+# Step 1: Hash-partition one input into buckets in a single pass
+def partition(chunks, bucket_dir, prefix, key, n_buckets=N_BUCKETS, schema=None):
+    print(f'Partitioning {prefix} into {n_buckets} buckets...')
+
+    try:
+        writers = {}
+        n_rows = 0
+        for chunk in chunks:
+            buckets = bucket_of(to_int64(chunk[key]), n_buckets)
+            for bucket, rows in chunk.groupby(buckets):
+                if bucket not in writers:
+                    writers[bucket] = TableWriter(bucket_dir, f"{prefix}_{bucket:04d}", schema)
+                writers[bucket].write(rows)
+            n_rows += len(chunk)
+        for writer in writers.values():
+            writer.close()
+        print(f'Partitioned {n_rows} rows.')
+        return n_rows
+
+    except Exception as e:
+        print(f'An error occured during partition: {str(e)}')
+        raise e
+
+
+# Step 2: Read one bucket, or an empty frame if no row fell into it
+def read_bucket(bucket_dir, prefix, bucket, empty):
+    name = f"{prefix}_{bucket:04d}"
+    if os.path.exists(os.path.join(bucket_dir, name + ".parquet")):
+        return read_table(bucket_dir, name)
+    return empty
@@ -1,71 +1,153 @@
 import pandas as pd
 import glob
 import os
+import json
 import pickle as pkl
+import argparse
 import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import pandas_schema, write_atomic, write_common_schema
+from id_index import build_index
 
-src = sys.argv[1]
+## Notes:
+# A pool of workers parses the per-domain csv-files, while the main process is
+# the only writer: it saves every parsed file into a Parquet dataset partitioned
+# by year and round (``domain_tweets/year=2020/round=initial/<domain>.parquet``).
+# Ingested files are listed in ``domain_tweets/_manifest.json``, so a rerun
+# only processes new or changed files. All files are written with one schema
+# built from ``dtypes_config.pickle`` (stored in ``domain_tweets/_common_metadata``),
+# so a column that is empty in one domain file is still a string column.
+# The ID index of the dataset is built at the end (see id_index.py).
+
+parser = argparse.ArgumentParser()
+parser.add_argument("src", help="data collection directory")
+parser.add_argument("--dst", default="/data/german_newsguard_tweets/",
+                    help="output directory")
+parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                    help="number of processes parsing csv-files")
+args = parser.parse_args()
+
+src = args.src
+dataset_dir = os.path.join(args.dst, "domain_tweets")
+manifest_path = os.path.join(dataset_dir, "_manifest.json")
 
 with open(os.path.join(src, "dtypes_config.pickle"), "rb") as file:
     DTYPES = pkl.load(file)
-    
+
 #select all of the above columns
 dcolumns = list(DTYPES.keys())
+date_columns = ["created_at", "author.created_at"]
+
+#the schema of all domain files
+columns = {col: pd.Series(dtype=dtype) for col, dtype in DTYPES.items()}
+columns.update({col: pd.Series(dtype="datetime64[us, UTC]") for col in date_columns})
+columns["domain"] = pd.Series(dtype=str)
+SCHEMA = pandas_schema(pd.DataFrame(columns))
+
+#step 1: parsing one domain file (runs in the workers)
+def read_domain(file_path):
+    df = pd.read_csv(file_path,
+                     dtype=DTYPES,
+                     usecols=dcolumns)
+    for col in date_columns:
+        df[col] = pd.to_datetime(df[col], utc=True)
+    domain = os.path.basename(file_path) #extracting the domain name from file name
+    df["domain"] = domain[:-4] #adding domain name as column
+    return df
 
-#step 1: defining a function to merge all the csvs in a directory (I will have to do it three times)
-def concat_domains(dir, year, round, print_header): #input arguments
+#step 2: keeping track of ingested files
+def file_state(file_path):
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def load_manifest():
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            return json.load(file)
+    return {}
+
+def write_manifest(manifest_path, manifest):
+    with write_atomic(manifest_path) as tmp_path, open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1)
+
+#step 3: parsing all csvs of a directory in parallel and writing them one by one
+def concat_domains(dir, year, round, pool, manifest): #input arguments
     file_name = os.path.join(dir, "*.csv") #extracting only csv-files in repository
-    file_paths = glob.glob(file_name) #using glob to get a list of all file paths that match the above pattern
-
-    for i, file_path in enumerate(file_paths): #looping through each file
-        df = pd.read_csv(file_path, 
-                         dtype=DTYPES, 
-                         usecols=dcolumns,
-                        parse_dates=["created_at", "author.created_at"]) 
-        domain = os.path.basename(file_path) #extracting the domain name from file name
-        df["domain"] = domain[:-4] #adding domain name as column
-        df["round"] = round #the round of data collection, i.e., intial or missing (second round)
-        df["year"] = year #time frame
-        df.to_csv("/data/german_newsguard_tweets/domain_tweets.csv.gz", 
-                  mode="a", 
-                  header=print_header and (i==0), 
-                  index=False, compression="gzip") #writing to one compressed csv
+    file_paths = sorted(glob.glob(file_name)) #using glob to get a list of all file paths that match the above pattern
+    todo = [file_path for file_path in file_paths
+            if manifest.get(file_path, {}).get("state") != file_state(file_path)]
+    print(f"Skipping {len(file_paths) - len(todo)} already ingested files.")
+
+    #the round of data collection, i.e., intial or missing (second round) and time frame
+    partition = os.path.join(dataset_dir, f"year={year}", f"round={round}")
+    os.makedirs(partition, exist_ok=True)
+
+    #the main process writes the parsed files in order, one at a time
+    def write_next():
+        file_path, future = pending.popleft()
+        df = future.result()
+        out_path = os.path.join(partition, os.path.basename(file_path)[:-4] + ".parquet")
+        table = pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+        with write_atomic(out_path) as tmp_path:
+            pq.write_table(table, tmp_path)
+        manifest[file_path] = {"state": file_state(file_path),
+                               "output": out_path, "rows": len(df)}
+        write_manifest(manifest_path, manifest)
+
+    #keeping only a few parsed files in flight to bound memory
+    pending = deque()
+    for file_path in todo:
+        pending.append((file_path, pool.submit(read_domain, file_path)))
+        if len(pending) > 2 * args.workers:
+            write_next()
+    while pending:
+        write_next()
     print("Done processing", round, "round for", year) #printing
 
-#step 2: running per year
-##2020
-year = "2020"
-dir_20 = os.path.join(src + year + "/domain_tweets_csv")
-round = "initial"
-print_header = True
-concat_domains(dir_20, year, round, print_header)
-
-##appending missing tweets to the same csv-file 
-year = "2020"
-round = "missing"
-print_header = False
-dir_20_mis= os.path.join(src + year + "/domain_tweets_missing_csv")
-concat_domains(dir_20_mis, year, round, print_header)
-
-##2021
-year = "2021"
-round = "initial"
-dir_21 = os.path.join(src + year + "/domain_tweets_csv")
-print_header = False
-concat_domains(dir_21, year, round, print_header)
-
-##2022
-year = "2022"
-round = "initial"
-dir_22 = os.path.join(src + year + "/domain_tweets_csv")
-print_header = False
-concat_domains(dir_22, year, round, print_header)
-
-##missing
-year = "2022"
-round = "missing"
-dir_22_mis = os.path.join(src + year + "/domain_tweets_missing_csv")
-print_header = False
-concat_domains(dir_22_mis, year, round, print_header)
-
-print("Processing complete.")
\ No newline at end of file
+#step 4: running per year
+def main():
+    os.makedirs(dataset_dir, exist_ok=True)
+    write_common_schema(args.dst, "domain_tweets", SCHEMA)
+    manifest = load_manifest()
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        ##2020
+        year = "2020"
+        dir_20 = os.path.join(src + year + "/domain_tweets_csv")
+        round = "initial"
+        concat_domains(dir_20, year, round, pool, manifest)
+
+        ##adding missing tweets to the same dataset
+        year = "2020"
+        round = "missing"
+        dir_20_mis= os.path.join(src + year + "/domain_tweets_missing_csv")
+        concat_domains(dir_20_mis, year, round, pool, manifest)
+
+        ##2021
+        year = "2021"
+        round = "initial"
+        dir_21 = os.path.join(src + year + "/domain_tweets_csv")
+        concat_domains(dir_21, year, round, pool, manifest)
+
+        ##2022
+        year = "2022"
+        round = "initial"
+        dir_22 = os.path.join(src + year + "/domain_tweets_csv")
+        concat_domains(dir_22, year, round, pool, manifest)
+
+        ##missing
+        year = "2022"
+        round = "missing"
+        dir_22_mis = os.path.join(src + year + "/domain_tweets_missing_csv")
+        concat_domains(dir_22_mis, year, round, pool, manifest)
+
+    #ID index of the domain tweets, for the membership tests of the later stages
+    build_index(args.dst, "domain_tweets")
+    print("Processing complete.")
+
+if __name__ == "__main__":
+    main()
@@ -3,18 +3,16 @@
 import pandas as pd
 import os
 import sys
-import pickle as pkl
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import read_table, write_table
 
 src = sys.argv[1]
-with open(os.path.join(src, "dtypes_config.pickle"), "rb") as file:
-    DTYPES = pkl.load(file)
 
-def add_ratings(dir, dtypes, parse_dates):
+def add_ratings(dir):
     # read files
-    domain_tweets = pd.read_csv(os.path.join(dir,
-                                             "domain_tweets.csv.gz"), 
-                                compression="gzip", 
-                                dtype=dtypes, parse_dates=parse_dates)
+    # the domain tweets dataset from 1_concat_domains.py is partitioned by
+    # year and round, which are read back as string columns
+    domain_tweets = read_table(dir, "domain_tweets")
     newsguard = pd.read_csv(os.path.join(dir,
                                          "newsguard_de.csv.gz"), 
                                 compression="gzip")
@@ -31,16 +29,10 @@ def add_ratings(dir, dtypes, parse_dates):
     tweet_ratings = pd.merge(domain_tweets, newsguard, 
                             on=["domain", "month"], 
                             how="left")
+    tweet_ratings["Rating_Date"] = pd.to_datetime(tweet_ratings["Rating_Date"])
 
     # save merged dataframe
-    tweet_ratings.to_csv(os.path.join(dir,"domain_tweets.csv.gz"), 
-                        index=False, compression="gzip")
+    write_table(dir, "domain_tweets_rated", tweet_ratings)
 
 
-parse_dates = ["created_at", "author.created_at"]
-
-add_ratings(
-    dir=src,
-    dtypes=DTYPES,
-    parse_dates=parse_dates
-)
\ No newline at end of file
+add_ratings(dir=src)
@@ -1,22 +1,64 @@
 # STEP 6: DROP DUPLICATES FROM DATAFRAME.
+import numpy as np
 import pandas as pd
-import pickle as pkl
 import os
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import iter_table, TableWriter
+from id_index import build_index, to_int64
+
+## Notes:
+# The table is deduplicated on (id, domain) in chunks, so only the keys are
+# kept in memory: one sorted int64 array of tweet IDs per domain, where the
+# domains are replaced by integer codes (-1 for tweets without a domain).
+# Surviving rows are written as they come, keeping the first occurrence.
+# The ID index of the final table is built at the end, for the later stages.
 
 src = sys.argv[1]
-with open(os.path.join(src, "dtypes_config.pickle"), "rb") as file:
-    DTYPES = pkl.load(file)
+chunk_size = 500000
+
+# Step 1: Translate the domains of a chunk into stable integer codes
+def domain_codes(domains, codes):
+    chunk_codes, uniques = pd.factorize(domains) # missing domains are -1
+    lookup = np.array([codes.setdefault(domain, len(codes)) for domain in uniques],
+                      dtype=np.int64)
+    return np.where(chunk_codes < 0, -1, lookup[chunk_codes] if len(lookup) else -1)
+
+# Step 2: Mark the rows whose (id, domain) key was not seen before
+def mark_new(ids, codes, seen):
+    # duplicates within the chunk itself
+    keep = ~pd.DataFrame({"id": ids, "domain": codes}).duplicated().to_numpy()
+
+    # duplicates of earlier chunks, looked up domain by domain
+    order = np.argsort(codes, kind="stable")
+    for group in np.split(order, np.flatnonzero(np.diff(codes[order])) + 1):
+        if len(group) == 0:
+            continue
+        code = codes[group[0]]
+        seen_ids = seen.get(code, np.empty(0, dtype=np.int64))
+        pos = np.searchsorted(seen_ids, ids[group])
+        found = seen_ids[np.minimum(pos, len(seen_ids) - 1)] == ids[group] \
+            if len(seen_ids) else np.zeros(len(group), dtype=bool)
+        keep[group[found]] = False
+
+        # merge the new IDs into the sorted array without re-sorting it
+        new_ids = np.unique(ids[group[keep[group]]])
+        seen[code] = np.insert(seen_ids, np.searchsorted(seen_ids, new_ids), new_ids)
+    return keep
 
-df = pd.read_csv(os.path.join(src,"german_newsguard_tweets.csv.gz"), 
-                                compression="gzip",
-                                dtype=DTYPES, 
-                                #nrows=10000 #testing
-                )
-print(f'Length of df with duplicates: {len(df)}')
+# Step 3: Stream the table and write the surviving rows
+n_rows, n_kept = 0, 0
+seen, codes = {}, {}
+with TableWriter(src, "german_newsguard_tweets") as writer:
+    for chunk in iter_table(src, "german_newsguard_tweets", batch_size=chunk_size):
+        ids = to_int64(chunk["id"])
+        keep = mark_new(ids, domain_codes(chunk["domain"], codes), seen)
+        writer.write(chunk[keep])
+        n_rows += len(chunk)
+        n_kept += int(keep.sum())
 
-df.drop_duplicates(subset=["id", "domain"], inplace=True)
-print(f'Length of df without duplicates: {len(df)}')
+print(f'Length of df with duplicates: {n_rows}')
+print(f'Length of df without duplicates: {n_kept}')
 
-df.to_csv(os.path.join(src, "german_newsguard_tweets.csv.gz"), 
-                        compression="gzip")
\ No newline at end of file
+# Step 4: Index the IDs of the deduplicated table
+build_index(src, "german_newsguard_tweets")
@@ -0,0 +1,150 @@
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from storage import iter_table, table_path, write_atomic
+
+## Notes:
+# Integer-keyed index of the tweet IDs, shared by the pipeline stages.
+# Tweet and conversation IDs are handled as int64 everywhere (missing IDs are
+# -1), instead of as strings in some stages and ints in others. The index of a
+# table is stored once next to it (``<src>/<name>_index/``) as .npy files:
+# the sorted tweet IDs with their conversation IDs, domain codes and row
+# offsets in the table, plus the sorted unique conversation IDs. The arrays
+# are memory-mapped when loaded, and membership lookups use np.searchsorted
+# instead of ``isin`` on Python sets of strings.
+
+FIELDS = ["ids", "conversation_ids", "domain_codes", "rows", "conversations"]
+
+
+# Step 1: Shared conversion of IDs to int64 keys
+def to_int64(ids):
+    ids = pd.Series(ids)
+    if not pd.api.types.is_integer_dtype(ids.dtype):
+        # parsed as nullable integers, a float64 column would round the
+        # 19-digit tweet IDs once any ID is missing
+        ids = pd.to_numeric(ids.astype("string"), errors="coerce")
+    return ids.astype("Int64").fillna(-1).to_numpy(dtype=np.int64)
+
+
+# Step 2: Vectorized membership and lookups on sorted int64 arrays
+def isin_sorted(values, sorted_keys):
+    values = np.asarray(values, dtype=np.int64)
+    if len(sorted_keys) == 0:
+        return np.zeros(len(values), dtype=bool)
+    pos = np.searchsorted(sorted_keys, values)
+    return sorted_keys[np.minimum(pos, len(sorted_keys) - 1)] == values
+
+
+def contains_ids(index, ids):
+    return isin_sorted(to_int64(ids), index["ids"])
+
+
+def contains_conversations(index, conversation_ids):
+    return isin_sorted(to_int64(conversation_ids), index["conversations"])
+
+
+def lookup_rows(index, ids):
+    # row offsets of the first occurrence of each ID in the table, -1 if missing
+    ids = to_int64(ids)
+    pos = np.minimum(np.searchsorted(index["ids"], ids), len(index["ids"]) - 1)
+    found = index["ids"][pos] == ids
+    return np.where(found, index["rows"][pos], -1)
+
+
+# Step 3: Build the index of a table in one column-projected pass
+def _source_state(src, name):
+    # a partitioned table (e.g. domain_tweets) changes with any of its files
+    path = table_path(src, name)
+    paths = sorted(glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True)) \
+        if os.path.isdir(path) else [path]
+    stats = [os.stat(path) for path in paths]
+    return {"files": len(stats), "size": sum(stat.st_size for stat in stats),
+            "mtime": max((stat.st_mtime for stat in stats), default=0)}
+
+
+def build_index(src, name="german_newsguard_tweets"):
+    print(f'Building ID index for {name}...')
+    index_dir = os.path.join(src, f"{name}_index")
+    os.makedirs(index_dir, exist_ok=True)
+
+    ids, conversation_ids, domain_codes = [], [], []
+    domains = {}
+    for chunk in iter_table(src, name, columns=["id", "conversation_id", "domain"]):
+        ids.append(to_int64(chunk["id"]))
+        conversation_ids.append(to_int64(chunk["conversation_id"]))
+        codes, uniques = pd.factorize(chunk["domain"]) # missing domains are -1
+        lookup = np.array([domains.setdefault(domain, len(domains))
+                           for domain in uniques] + [-1], dtype=np.int32)
+        domain_codes.append(lookup[codes])
+
+    ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    arrays = {"ids": ids[order],
+              "conversation_ids": np.concatenate(conversation_ids)[order] if len(ids) else ids,
+              "domain_codes": np.concatenate(domain_codes)[order] if len(ids)
+                              else np.empty(0, dtype=np.int32),
+              "rows": order.astype(np.int64)}
+    arrays["conversations"] = np.unique(arrays["conversation_ids"])
+
+    # index.json is written last, an index interrupted before it is rebuilt
+    for field, values in arrays.items():
+        with write_atomic(os.path.join(index_dir, f"{field}.npy")) as tmp_path, \
+                open(tmp_path, "wb") as file:
+            np.save(file, values)
+    with write_atomic(os.path.join(index_dir, "index.json")) as tmp_path, \
+            open(tmp_path, "w") as file:
+        json.dump({"source": _source_state(src, name),
+                   "domains": list(domains)}, file)
+    print(f'Indexed {len(ids)} tweets in {len(arrays["conversations"])} conversations.')
+
+
+# Step 4: Load the (memory-mapped) index, rebuilding it if the table changed
+def load_index(src, name="german_newsguard_tweets"):
+    index_dir = os.path.join(src, f"{name}_index")
+    meta_path = os.path.join(index_dir, "index.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+    if not os.path.exists(meta_path) or meta["source"] != _source_state(src, name):
+        build_index(src, name)
+        with open(meta_path) as file:
+            meta = json.load(file)
+
+    index = {field: np.load(os.path.join(index_dir, f"{field}.npy"), mmap_mode="r")
+             for field in FIELDS}
+    index["domains"] = meta["domains"]
+    return index
+
+
+# Step 5: (id, domain) keys of existing results, e.g. of the inference outputs
+def parts_dir(path):
+    # increments of a results file are separate files next to it,
+    # e.g. emotion_inference_parts/ for emotion_inference.csv.gz
+    return path[:-len(".csv.gz")] + "_parts"
+
+
+def result_paths(path):
+    # a results file followed by its increments
+    paths = [path] if os.path.exists(path) else []
+    if path.endswith(".csv.gz"):
+        paths += sorted(glob.glob(os.path.join(glob.escape(parts_dir(path)), "*.csv.gz")))
+    return paths
+
+
+def read_keys(path, sep=","):
+    paths = result_paths(path)
+    if not paths:
+        return None
+    keys = pd.concat([pd.read_csv(path, sep=sep, usecols=["id", "domain"], dtype={"domain": str})
+                      for path in paths], ignore_index=True)
+    return pd.MultiIndex.from_arrays([to_int64(keys["id"]), keys["domain"].to_numpy(dtype=object)])
+
+
+def missing_keys(ids, domains, keys):
+    # rows whose (id, domain) key is not in keys, missing domains match each other
+    if keys is None:
+        return np.ones(len(ids), dtype=bool)
+    rows = pd.MultiIndex.from_arrays([to_int64(ids), np.asarray(domains, dtype=object)])
+    return ~rows.isin(keys)
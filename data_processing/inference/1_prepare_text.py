@@ -1,65 +1,79 @@
+import argparse
+import gzip
 import pandas as pd
 import os
-import re
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import iter_table
+from text_cleaning import clean_texts
+from id_index import missing_keys, read_keys
 
-#load data set with dtypes
-dir = sys.argv[1]
+parser = argparse.ArgumentParser()
+parser.add_argument("dir", help="data directory")
+parser.add_argument("--incremental", action="store_true",
+                    help="clean only tweets without emotion or group inference into german_newsguard_text_delta.csv.gz")
+args = parser.parse_args()
 
-df = pd.read_csv(os.path.join(dir,"german_newsguard_tweets.csv.gz"), 
-                                compression="gzip",
-                                usecols=["id", "domain", "lang", "text"],
-                                dtype={"id": str, "domain":str, "lang":str, "text":str}, 
-                                #nrows=10000, #testing
-                )
+#the table is streamed in chunks, the row numbers of the full table are kept as index
+dir = args.dir
+chunk_size = 500000
+output_name = "german_newsguard_text_delta.csv.gz" if args.incremental \
+    else "german_newsguard_text.csv.gz"
 
-print(f'Length of unprocessed df: {len(df)}')
+counts = {"unprocessed": 0, "german": 0, "cleaned": 0, "non_na": 0, "non_empty": 0}
 
-#keep only german tweets where lang == "de"
-df_de = df[df["lang"] == "de"]
-print(f'Length of only German df: {len(df_de)}')
+#in incremental mode, tweets that already have both inferences are skipped
+inferred = []
+if args.incremental:
+    emotion_keys = read_keys(os.path.join(dir, "inference/emotion_inference.csv.gz"))
+    group_keys = read_keys(os.path.join(dir, "inference/group_inference_condensed.csv.gz"), sep=";")
+    inferred = [keys for keys in [emotion_keys, group_keys] if keys is not None]
+    counts["inferred"] = 0
 
-# clean text
+# clean text (vectorized, see text_cleaning.py)
 def clean_text(df):
-    tweet_text = df["text"].tolist()
     df_new = df.copy()
-    tweet_text_lst_clean = []
-    emoji_pattern = re.compile("["
-                        u"\U0001F600-\U0001F64F"  # emoticons
-                        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                        u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                        u"\U0001F700-\U0001F77F"  # alchemical symbols
-                        u"\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
-                        u"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
-                        u"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
-                        u"\U0001FA00-\U0001FA6F"  # Chess Symbols
-                        u"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
-                        u"\U00002702-\U000027B0"  # Dingbats
-                        u"\U000024C2-\U0001F251" 
-                        "]+", flags=re.UNICODE)
-    
-    for item in tweet_text:
-        item_new = emoji_pattern.sub(r'', item) # remove emojis
-        item_new = re.sub("https.*", "", item_new)  # remove links
-        item_new = re.sub("@\w+", "", item_new) # remove @-handles
-        item_new = item_new.replace('\\n', ' ') # remove line breaks
-        item_new = item_new.replace('\\', '') # remove backslash
-        tweet_text_lst_clean.append(item_new)
-        
-    df_new["text_cleaned"] = tweet_text_lst_clean
+    df_new["text_cleaned"] = clean_texts(df["text"]).to_pandas()\
+                                                     .set_axis(df.index)
     return df_new
 
-df_cleaned = clean_text(df_de)
-print(f'Length of cleaned df: {len(df_cleaned)}')
+#save cleaned data
+with gzip.open(os.path.join(dir, output_name), "wt") as file:
+    offset = 0
+    for df in iter_table(dir, "german_newsguard_tweets",
+                         columns=["id", "domain", "lang", "text"],
+                         batch_size=chunk_size):
+        df.index = pd.RangeIndex(offset, offset + len(df))
+        offset += len(df)
+        counts["unprocessed"] += len(df)
 
-df_cleaned.dropna(subset=["text_cleaned"], inplace=True) 
-print(f'Length of cleaned df without NAs: {len(df_cleaned)}')
+        #keep only german tweets where lang == "de"
+        df_de = df[df["lang"] == "de"]
+        counts["german"] += len(df_de)
 
-df_cleaned = df_cleaned[df_cleaned["text_cleaned"] != ""] #remove empty strings
-print(f'Length of cleaned df without empty strings: {len(df_cleaned)}')
+        if inferred:
+            missing = missing_keys(df_de["id"], df_de["domain"], inferred[0])
+            for keys in inferred[1:]:
+                missing |= missing_keys(df_de["id"], df_de["domain"], keys)
+            counts["inferred"] += int((~missing).sum())
+            df_de = df_de[missing]
 
-#save cleaned data
-df_cleaned.to_csv(os.path.join(dir, "german_newsguard_text.csv.gz"), 
-                            mode="w", compression="gzip", 
-                            columns=["id", "domain", "text_cleaned"],
-                            header=True)
\ No newline at end of file
+        df_cleaned = clean_text(df_de)
+        counts["cleaned"] += len(df_cleaned)
+
+        df_cleaned = df_cleaned.dropna(subset=["text_cleaned"])
+        counts["non_na"] += len(df_cleaned)
+
+        df_cleaned = df_cleaned[df_cleaned["text_cleaned"] != ""] #remove empty strings
+        counts["non_empty"] += len(df_cleaned)
+
+        df_cleaned.to_csv(file, columns=["id", "domain", "text_cleaned"],
+                          header=(offset == len(df)))
+
+print(f'Length of unprocessed df: {counts["unprocessed"]}')
+print(f'Length of only German df: {counts["german"]}')
+if "inferred" in counts:
+    print(f'Skipped with existing inference: {counts["inferred"]}')
+print(f'Length of cleaned df: {counts["cleaned"]}')
+print(f'Length of cleaned df without NAs: {counts["non_na"]}')
+print(f'Length of cleaned df without empty strings: {counts["non_empty"]}')
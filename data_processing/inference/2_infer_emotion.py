@@ -2,17 +2,60 @@
 
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
-import pytorch_lightning as pl
-from torchmetrics import F1Score
-from torchmetrics.functional import accuracy, auroc #F1Score #f1
-from pytorch_lightning.callbacks import ModelCheckpoint, EarlyStopping
-from pytorch_lightning.loggers import TensorBoardLogger
-from transformers import AutoTokenizer, DebertaV2Model, AdamW, get_linear_schedule_with_warmup
+import numpy as np
 import pandas as pd
+import argparse
+import copy
+import glob
+import gzip
+import json
 import os
-import tqdm
+import shutil
 import sys
+import threading
+import time
+import tqdm
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from text_cleaning import clean_texts
+import score_cache
+from emotion_model import LABEL_COLUMNS, WEIGHTS_FILE, load_scorer, load_tokenizer
+from id_index import missing_keys, parts_dir, read_keys
+from storage import write_atomic
+
+parser = argparse.ArgumentParser()
+parser.add_argument("src", help="data directory")
+parser.add_argument("file", help="cleaned text file (german_newsguard_text.csv.gz)")
+parser.add_argument("--batching", choices=["tokens", "fixed"], default="tokens",
+                    help="batches of similar length by token budget, or fixed-size batches in file order")
+parser.add_argument("--max-tokens", type=int, default=8192,
+                    help="token budget of a batch (rows x padded length)")
+parser.add_argument("--window", type=int, default=100000,
+                    help="number of rows tokenized and sorted at once")
+parser.add_argument("--threads", type=int, default=None,
+                    help="intra-op threads of the CPU forward pass")
+parser.add_argument("--quantize", action="store_true",
+                    help="dynamic int8 quantization of the DeBERTa linear layers (CPU only)")
+parser.add_argument("--export", choices=["torchscript", "onnx"], default=None,
+                    help="export the scoring model to ./model/ instead of scoring")
+parser.add_argument("--check-accuracy", metavar="VALIDATION_FILE", default=None,
+                    help="compare the scores with fp32 on emotion_validation_mode.csv instead of scoring")
+parser.add_argument("--shards", type=int, default=1,
+                    help="number of id-range shards, each written with a completion marker")
+parser.add_argument("--workers", type=int, default=1,
+                    help="number of processes scoring shards")
+parser.add_argument("--prefetch", type=int, default=0,
+                    help="windows tokenized ahead of the model and written behind it (0 runs the stages in turn)")
+parser.add_argument("--tokenizer-threads", type=int, default=2,
+                    help="threads tokenizing windows ahead of the model")
+parser.add_argument("--incremental", action="store_true",
+                    help="score only tweets not yet in emotion_inference.csv.gz (or its parts) into a new part file")
+parser.add_argument("--no-cache", action="store_true",
+                    help="score every row, without the score cache of the texts")
+parser.add_argument("--eager-load", action="store_true",
+                    help="build the model from the pretrained weights instead of mapping the fine-tuned ones lazily")
+args = parser.parse_args()
 
 # set working directory to the pol_emo_mDeBERTa 
 os.chdir("./inference/pol_emo_mDeBERTa")
@@ -20,136 +63,363 @@ set_directory = os.getcwd()
 print("Working directory set to:", set_directory)
 
 # set data directory
-src = sys.argv[1] 
-file = sys.argv[2]
-
-df = pd.read_csv(os.path.join(src,file), 
-                                compression="gzip",
-                                usecols=["id", "domain", "text_cleaned"],
-                                dtype={"id": int, "domain":str, "text_cleaned":str},
-                                #nrows=100000
-                )
-
+src = args.src
+file = args.file
+output_file = os.path.join(src, 'emotion_inference.csv.gz')
+increments_dir = parts_dir(output_file)
+shard_dir = os.path.join(src, 'emotion_inference_shards')
+cache_dir = os.path.join(src, 'emotion_score_cache')
 
-#define function to apply mDeBERTa model
-LABEL_COLUMNS = ['anger_v2', 'fear_v2', 'disgust_v2', 'sadness_v2', 'joy_v2', 'enthusiasm_v2', 'pride_v2', 'hope_v2']
-BASE_MODEL_NAME = "microsoft/mdeberta-v3-base"
-tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+#define function to apply mDeBERTa model (inference only, see emotion_model.py)
+tokenizer = None
 batch_size = 32
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print("Process running on:", device)
+if args.quantize and device != "cpu":
+    parser.error("--quantize is only supported on CPU")
+
+# define batches of rows
+def fixed_batches(lengths):
+    # fixed-size batches in file order
+    return [np.arange(start, min(start + batch_size, len(lengths)))
+            for start in range(0, len(lengths), batch_size)]
+
+def token_batches(lengths):
+    # rows sorted by token length, cut into batches whose padded size
+    # (rows x longest row) stays within the token budget
+    order = np.argsort(lengths, kind="stable")
+    batches, start = [], 0
+    for end in range(1, len(order) + 1):
+        if (end - start) * lengths[order[end - 1]] > args.max_tokens and end - 1 > start:
+            batches.append(order[start:end - 1])
+            start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+def padding_ratio(lengths, batches):
+    padded = sum(len(rows) * lengths[rows].max() for rows in batches)
+    return 1 - lengths.sum() / padded
+
+def build_scorer(model):
+    # worker processes share the cores unless the thread count is given
+    threads = args.threads or (max(1, os.cpu_count() // args.workers) if args.workers > 1 else None)
+    if threads:
+        torch.set_num_threads(threads)
+    if not args.quantize:
+        return model
+    scorer = copy.deepcopy(model)
+    scorer.bert = torch.quantization.quantize_dynamic(scorer.bert, {nn.Linear}, dtype=torch.qint8)
+    return scorer
+
+def export_scorer(scorer, kind):
+    example = tokenizer(["Beispieltext"], return_tensors="pt").to(device)
+    inputs = (example["input_ids"], example["attention_mask"])
+    suffix = "_int8" if args.quantize else ""
+    with torch.inference_mode():
+        if kind == "torchscript":
+            path = f"./model/emotion_scorer{suffix}.pt"
+            torch.jit.trace(scorer, inputs).save(path)
+        else:
+            if args.quantize:
+                raise ValueError("Dynamically quantized models can not be exported to ONNX.")
+            path = "./model/emotion_scorer.onnx"
+            torch.onnx.export(scorer, inputs, path,
+                              input_names=["input_ids", "attention_mask"],
+                              output_names=["scores"],
+                              dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                            "attention_mask": {0: "batch", 1: "sequence"},
+                                            "scores": {0: "batch"}},
+                              opset_version=14)
+    print("Exported scoring model to:", path)
 
-class CrowdCodedTagger(pl.LightningModule):
-
-  def __init__(self, n_classes: int, n_training_steps=None, n_warmup_steps=None):
-    super().__init__()
-    self.bert = DebertaV2Model.from_pretrained(BASE_MODEL_NAME, return_dict=True)
-    self.classifier = nn.Linear(self.bert.config.hidden_size, n_classes)
-    self.n_training_steps = n_training_steps
-    self.n_warmup_steps = n_warmup_steps
-    self.criterion = nn.BCELoss()
-
-  def forward(self, input_ids, attention_mask, labels=None, token_type_ids=None):
-    output = self.bert(input_ids, attention_mask=attention_mask)
-    output = self.classifier(output.last_hidden_state[:, 0])
-    output = torch.sigmoid(output)
-    loss = 0
-    if labels is not None:
-        loss = self.criterion(output, labels)
-    return loss, output
-
-  def training_step(self, batch, batch_idx):
-    input_ids = batch["input_ids"]
-    attention_mask = batch["attention_mask"]
-    labels = batch["labels"]
-    loss, outputs = self(input_ids, attention_mask, labels)
-    self.log("train_loss", loss, prog_bar=True, logger=True)
-    return {"loss": loss, "predictions": outputs, "labels": labels}
-
-  def validation_step(self, batch, batch_idx):
-    input_ids = batch["input_ids"]
-    attention_mask = batch["attention_mask"]
-    labels = batch["labels"]
-    loss, outputs = self(input_ids, attention_mask, labels)
-    self.log("val_loss", loss, prog_bar=True, logger=True)
-    return loss
-
-  def test_step(self, batch, batch_idx):
-    input_ids = batch["input_ids"]
-    attention_mask = batch["attention_mask"]
-    labels = batch["labels"]
-    loss, outputs = self(input_ids, attention_mask, labels)
-    self.log("test_loss", loss, prog_bar=True, logger=True)
-    return loss
-
-  def training_epoch_end(self, outputs):
-
-    labels = []
-    predictions = []
-    for output in outputs:
-      for out_labels in output["labels"].detach().cpu():
-        labels.append(out_labels)
-      for out_predictions in output["predictions"].detach().cpu():
-        predictions.append(out_predictions)
-
-    labels = torch.stack(labels).int()
-    predictions = torch.stack(predictions)
-
-    for i, name in enumerate(LABEL_COLUMNS):
-      class_roc_auc = auroc(predictions[:, i], labels[:, i])
-      self.logger.experiment.add_scalar(f"{name}_roc_auc/Train", class_roc_auc, self.current_epoch)
-
-  def configure_optimizers(self):
-
-    optimizer = AdamW(self.parameters(), lr=2e-5) #DEFINING LEARNING RATE
-
-    scheduler = get_linear_schedule_with_warmup(
-      optimizer,
-      num_warmup_steps=self.n_warmup_steps,
-      num_training_steps=self.n_training_steps
-    )
-
-    return dict(
-      optimizer=optimizer,
-      lr_scheduler=dict(
-        scheduler=scheduler,
-        interval='step'
-      )
-    )
+# pad the batches of token ids into tensors
+def encode_batches(input_ids, batches, tok=None):
+    tok = tok or tokenizer
+    return [tok.pad({"input_ids": [input_ids[row] for row in rows]},
+                          return_tensors='pt')
+            for rows in batches]
+
+# score padded batches, scores are filled in at the original positions of the rows
+def score_encoded(scorer, batches, encoded, lengths, stats):
+    scores = np.empty((len(lengths), len(LABEL_COLUMNS)))
+    with torch.inference_mode():
+        for rows, encoded_input in zip(tqdm.tqdm(batches), encoded):
+            start_time = time.perf_counter()
+            encoded_input = encoded_input.to(device)
+            outputs = scorer(encoded_input["input_ids"], encoded_input["attention_mask"])
+            scores[rows] = outputs.cpu().numpy()
+            stats["elapsed"] += time.perf_counter() - start_time
+            stats["tokens"] += lengths[rows].sum()
+            stats["padded"] += encoded_input["input_ids"].numel()
+    return scores
+
+def score_batches(scorer, input_ids, batches, stats):
+    lengths = np.array([len(ids) for ids in input_ids])
+    return score_encoded(scorer, batches, encode_batches(input_ids, batches), lengths, stats)
+
+# stages of the inference: cache lookup, tokenization, model and writer
+def lookup_window(window, cache, pending_keys):
+    # only texts that are neither cached, nor repeated in the window, nor
+    # scored with an earlier window still ahead in the queue reach the model
+    texts = window["text_cleaned"].to_numpy()
+    if cache is not None:
+        keys = score_cache.text_keys(texts)
+        found, scores = score_cache.lookup(cache, keys)
+    else:
+        keys = np.arange(len(window))
+        found, scores = np.zeros(len(window), dtype=bool), np.empty((len(window), len(LABEL_COLUMNS)))
+    # scores of pending texts are looked up once the earlier windows are scored
+    deferred = ~found & np.isin(keys, pending_keys)
+    missing = np.flatnonzero(~found & ~deferred)
+    unique_keys, first, inverse = np.unique(keys[missing], return_index=True,
+                                            return_inverse=True)
+    return {"found": found, "scores": scores, "missing": missing,
+            "deferred": np.flatnonzero(deferred), "deferred_keys": keys[deferred],
+            "keys": unique_keys, "inverse": inverse, "texts": texts[missing[first]].tolist()}
+
+thread_state = threading.local()
+
+def tokenize_window(texts):
+    # each tokenizer thread uses its own copy, the fast tokenizer is not thread-safe
+    if not hasattr(thread_state, "tokenizer"):
+        thread_state.tokenizer = copy.deepcopy(tokenizer)
+    tok = thread_state.tokenizer
+
+    # tokenize the whole window up front, without padding
+    make_batches = token_batches if args.batching == "tokens" else fixed_batches
+    input_ids = tok(texts, truncation=True, max_length=280)["input_ids"]
+    lengths = np.array([len(ids) for ids in input_ids])
+    batches = make_batches(lengths)
+    print(f"Padding ratio of fixed batches: {padding_ratio(lengths, fixed_batches(lengths)):.1%}, "
+          f"of {args.batching} batches: {padding_ratio(lengths, batches):.1%}")
+    return batches, encode_batches(input_ids, batches, tok), lengths
+
+def write_window(output_df, output_path):
+    # Append to an existing CSV file or create a new one
+    output_df.to_csv(output_path, mode='a', index=False, header=not os.path.exists(output_path), compression="gzip")
 
 # define function for inference
-def predict_labels(df):
-    input_text = df["text_cleaned"].tolist()
-    num_inputs = len(input_text)
-    num_batches = (num_inputs - 1) // batch_size + 1
+def predict_labels(df, scorer, output_path, cache=None):
+    stats = {"tokens": 0, "padded": 0, "elapsed": 0.0, "hits": 0, "rows": 0}
+    new_keys, new_scores = [], []
+
+    # with --prefetch N, the tokenizer threads run N windows ahead of the model
+    # and the writer thread lags up to N windows behind; 0 runs them in turn
+    pending, writes = deque(), deque()
+    with ThreadPoolExecutor(args.tokenizer_threads) as tokenize_pool, \
+         ThreadPoolExecutor(1) as write_pool:
+
+        def score_next():
+            window, lookup, future = pending.popleft()
+            scores = lookup["scores"]
+            if future is not None:
+                unique_scores = score_encoded(scorer, *future.result(), stats)
+                scores[lookup["missing"]] = unique_scores[lookup["inverse"]]
+                if cache is not None:
+                    score_cache.add(cache, lookup["keys"], unique_scores)
+                    new_keys.append(lookup["keys"])
+                    new_scores.append(unique_scores)
+            if len(lookup["deferred"]):
+                scores[lookup["deferred"]] = score_cache.lookup(cache, lookup["deferred_keys"])[1]
 
-    try:
-        for i, batch in enumerate(tqdm.tqdm(range(num_batches))):
-            start_idx = i * batch_size
-            end_idx = min((i + 1) * batch_size, num_inputs)
-            batch_text = input_text[start_idx:end_idx]
+            output_df = pd.DataFrame(scores, columns=LABEL_COLUMNS)
+            output_df = pd.concat([window, output_df], axis=1)
+            writes.append(write_pool.submit(write_window, output_df, output_path))
+            while len(writes) > args.prefetch:
+                writes.popleft().result()
 
-            encoded_input = tokenizer(batch_text, padding=True, truncation=True, max_length=280, return_tensors='pt')
-            outputs = model(**encoded_input.to(device))
+        for window_start in range(0, len(df), args.window):
+            window = df.iloc[window_start:window_start + args.window].reset_index(drop=True)
+            pending_keys = np.concatenate([np.empty(0, dtype=np.uint64)] +
+                                          [queued["keys"] for _, queued, _ in pending]) \
+                if cache is not None else np.empty(0, dtype=np.uint64)
+            lookup = lookup_window(window, cache, pending_keys)
+            stats["hits"] += int(lookup["found"].sum()) + len(lookup["deferred"])
+            stats["rows"] += len(window)
+            future = tokenize_pool.submit(tokenize_window, lookup["texts"]) \
+                if lookup["texts"] else None
+            pending.append((window, lookup, future))
+            if len(pending) > args.prefetch:
+                score_next()
+        while pending:
+            score_next()
+        while writes:
+            writes.popleft().result()
 
-            tensor_values = outputs[1].tolist()
-            decimal_numbers = [[num for num in sublist] for sublist in tensor_values]
+    if stats["padded"]:
+        print(f"{args.batching} batching: {stats['tokens'] / stats['elapsed']:,.0f} tokens/s, "
+              f"padding ratio {1 - stats['tokens'] / stats['padded']:.1%}")
+    if cache is not None and stats["rows"]:
+        print(f"Cache hits: {stats['hits']} of {stats['rows']} rows ({stats['hits'] / stats['rows']:.1%})")
+    if new_keys:
+        return np.concatenate(new_keys), np.concatenate(new_scores)
+    return None
 
-            output_df = pd.DataFrame(decimal_numbers, columns=LABEL_COLUMNS)
-            input_df = df.iloc[start_idx:end_idx].reset_index(drop=True)
-            output_df = pd.concat([input_df, output_df], axis=1)
+# compare the scores of the scorer with the fp32 model on the validation tweets
+def check_accuracy(val_file, scorer, reference):
+    df_val = pd.read_csv(val_file)
+    texts = clean_texts(df_val["Text"].fillna("")).to_pylist()
+    input_ids = tokenizer(texts, truncation=True, max_length=280)["input_ids"]
+    batches = token_batches(np.array([len(ids) for ids in input_ids]))
 
-            # Append to an existing CSV file or create a new one
-            output_df.to_csv(os.path.join(src, 'emotion_inference.csv.gz'), mode='a', index=False, header=not os.path.exists(os.path.join(src, 'emotion_inference.csv.gz')), compression="gzip")
+    stats_fp32 = {"tokens": 0, "padded": 0, "elapsed": 0.0}
+    stats_fast = {"tokens": 0, "padded": 0, "elapsed": 0.0}
+    scores_fp32 = score_batches(reference, input_ids, batches, stats_fp32)
+    scores_fast = score_batches(scorer, input_ids, batches, stats_fast)
+    print(f"fp32: {stats_fp32['tokens'] / stats_fp32['elapsed']:,.0f} tokens/s, "
+          f"fast path: {stats_fast['tokens'] / stats_fast['elapsed']:,.0f} tokens/s")
 
-    except KeyboardInterrupt:
-        print("KeyboardInterrupt.")
+    manual = df_val[[f"{col[:-3]}_manual" for col in LABEL_COLUMNS]].to_numpy()
+    for i, col in enumerate(LABEL_COLUMNS):
+        rated = ~np.isnan(manual[:, i])
+        labels = manual[rated, i] == 1
+        f1 = {}
+        for name, scores in [("fp32", scores_fp32), ("fast", scores_fast)]:
+            predicted = scores[rated, i] > 0.5
+            f1[name] = 2 * (labels & predicted).sum() / max(labels.sum() + predicted.sum(), 1)
+        print(f"{col[:-3]}: max abs diff {np.abs(scores_fast[:, i] - scores_fp32[:, i]).max():.4f}, "
+              f"label agreement {np.mean((scores_fast[:, i] > 0.5) == (scores_fp32[:, i] > 0.5)):.1%}, "
+              f"F1 fp32 {f1['fp32']:.3f}, F1 fast path {f1['fast']:.3f}")
+
+# load local fine-tuned model in evaluation mode
+MODEL_DIR = "./model"
+
+def load_model():
+    return load_scorer(MODEL_DIR, device, eager=args.eager_load)
+
+# id-range shards, scored by one process each
+shard_scorer = None
+shard_cache = None
+
+def open_score_cache():
+    # quantized scores are cached separately from fp32 scores
+    fingerprint = score_cache.model_fingerprint(os.path.join(MODEL_DIR, WEIGHTS_FILE), "int8" if args.quantize else "")
+    return score_cache.open_cache(cache_dir, fingerprint, len(LABEL_COLUMNS))
+
+def init_worker():
+    global shard_scorer, shard_cache
+    shard_scorer = build_scorer(load_model())
+    shard_cache = None if args.no_cache else open_score_cache()
+
+def shard_path(shard):
+    return os.path.join(shard["dir"], f"shard_{shard['shard']:04d}.csv.gz")
+
+def shard_ranges(ids, directory):
+    # contiguous ranges of the sorted ids of about equal size,
+    # all rows of an id are in the same shard, no rows give no shards
+    if len(ids) == 0:
+        return []
+    cuts = np.linspace(0, len(ids), args.shards + 1).astype(int)[1:-1]
+    bounds = np.unique(np.concatenate([[0], np.searchsorted(ids, ids[cuts]), [len(ids)]]))
+    return [{"shard": shard, "dir": directory,
+             "first_id": int(ids[start]), "last_id": int(ids[end - 1]),
+             "rows": int(end - start), "start": int(start), "end": int(end)}
+            for shard, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+def is_complete(shard):
+    marker = shard_path(shard) + ".done"
+    if not os.path.exists(marker):
+        return False
+    with open(marker) as f:
+        return json.load(f) == shard
+
+def score_shard(shard, df_shard):
+    # the shard is written to a hidden file and marked complete once renamed
+    path = shard_path(shard)
+    with write_atomic(path) as tmp_path:
+        entries = predict_labels(df_shard, shard_scorer, tmp_path, shard_cache)
+        if entries is not None:
+            score_cache.save_entries(path + ".cache.npz", *entries)
+    with write_atomic(path + ".done") as tmp_path, open(tmp_path, "w") as f:
+        json.dump(shard, f)
+    return shard["shard"]
+
+def merge_shards(shards, output):
+    # shards cover increasing id ranges, so concatenating them keeps the id order
+    with write_atomic(output) as tmp_path, gzip.open(tmp_path, "wt") as out:
+        for shard in shards:
+            with gzip.open(shard_path(shard), "rt") as f:
+                header = f.readline()
+                if shard["shard"] == 0:
+                    out.write(header)
+                shutil.copyfileobj(f, out)
+    print(f"Merged {len(shards)} shards into:", output)
+
+def remove_increment(directory):
+    # the shards of an increment are no longer needed once they are merged into
+    # its part file and their scores are in the cache
+    if not args.no_cache:
+        score_cache.merge_entries(open_score_cache(),
+                                  os.path.join(directory, "shard_*.csv.gz.cache.npz"))
+    shutil.rmtree(directory)
+
+def main():
+    global tokenizer
+    tokenizer = load_tokenizer()
+
+    if args.export or args.check_accuracy:
+        model = load_model()
+        scorer = build_scorer(model)
+        if args.export:
+            export_scorer(scorer, args.export)
+        else:
+            check_accuracy(args.check_accuracy, scorer, model)
         return
 
-# put model into evaluation mode and load local fine-tuned model
-model = CrowdCodedTagger(n_classes=8)
-model.load_state_dict(torch.load("./model/pytorch_model.pt"), strict = False)
-model.to(device)
-model.eval()
+    df = pd.read_csv(os.path.join(src,file), 
+                                    compression="gzip",
+                                    usecols=["id", "domain", "text_cleaned"],
+                                    dtype={"id": int, "domain":str, "text_cleaned":str},
+                                    #nrows=100000
+                    )
+    df = df.sort_values("id", kind="stable").reset_index(drop=True)
+
+    # in incremental mode, only the tweets without scores are sharded,
+    # into a directory of their own
+    directory = shard_dir
+    if args.incremental:
+        df = df[missing_keys(df["id"], df["domain"], read_keys(output_file))].reset_index(drop=True)
+        print(f"Tweets without emotion scores: {len(df)}")
+        if df.empty:
+            # increments left over by an interrupted run are all in part files
+            for directory in glob.glob(os.path.join(shard_dir, "delta_*")):
+                remove_increment(directory)
+            return
+        directory = os.path.join(shard_dir, f"delta_{df['id'].iloc[0]}_{df['id'].iloc[-1]}_{len(df)}")
+
+    # a rerun scores only the shards without (matching) completion marker
+    os.makedirs(directory, exist_ok=True)
+    shards = shard_ranges(df["id"].to_numpy(), directory)
+    if not shards:
+        print("No tweets to score.")
+        return
+    todo = [shard for shard in shards if not is_complete(shard)]
+    print(f"Skipping {len(shards) - len(todo)} completed shards, scoring {len(todo)}.")
+
+    parts = [df.iloc[shard["start"]:shard["end"]] for shard in todo]
+    if args.workers > 1:
+        with ProcessPoolExecutor(args.workers, initializer=init_worker) as pool:
+            for shard in pool.map(score_shard, todo, parts):
+                print(f"Shard {shard} complete.")
+    else:
+        init_worker()
+        for shard, part in zip(todo, parts):
+            print(f"Shard {score_shard(shard, part)} complete.")
+
+    # an increment is written as a part file next to the output (read together
+    # with it, see id_index.result_paths), so the existing results are not rewritten
+    if args.incremental:
+        os.makedirs(increments_dir, exist_ok=True)
+        merge_shards(shards, os.path.join(increments_dir, os.path.basename(directory) + ".csv.gz"))
+        remove_increment(directory)
+        return
+    merge_shards(shards, output_file)
+    # the full output replaces the increments
+    shutil.rmtree(increments_dir, ignore_errors=True)
+    if not args.no_cache:
+        score_cache.merge_entries(open_score_cache(),
+                                  os.path.join(directory, "shard_*.csv.gz.cache.npz"))
 
-predict_labels(df)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
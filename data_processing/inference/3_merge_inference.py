@@ -1,61 +1,151 @@
+import glob
+import json
 import pandas as pd
+import os
 from os.path import join
 import pickle
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import iter_table, read_table, table_path, write_atomic, TableWriter
+from buckets import N_BUCKETS, partition, read_bucket
+from id_index import result_paths
+
+## Notes:
+# The tweets, the emotion inference and the group inference are hash-partitioned
+# by tweet ID into on-disk buckets (see buckets.py) and left-joined on
+# (id, domain) bucket by bucket, so only one bucket of each input is in memory
+# and the output is written incrementally. The join must keep the number of
+# tweets: duplicated (id, domain) keys in an inference file raise an error.
+# The columns are renamed on the way (public_metrics.* and *_v2), so the later
+# stages only add sidecar columns to the table. The buckets are kept between
+# runs (``_inference_buckets/_state.json`` records the inputs they hold), so a
+# rerun only partitions inputs that changed: after an incremental emotion
+# inference, only its new part files (emotion_inference_parts/) are read.
 
 src = sys.argv[1]
+chunk_size = 500000
+bucket_dir = join(src, "_inference_buckets")
+
+KEYS = ["id", "domain"] #identifier
+EMOTIONS = ["anger_v2", "fear_v2", "disgust_v2", "sadness_v2", #neg emotions
+            "joy_v2", "enthusiasm_v2", "pride_v2", "hope_v2"] #pos emotions
+GROUPS = ["group", "not_out", "out"]
 
-with open(join(src, "dtypes_config.pickle"), 
+with open(join(src, "dtypes_config.pickle"),
           'rb') as file:
     DTYPES = pickle.load(file)
 
-df = pd.read_csv(join(src, 
-                      "german_newsguard_tweets.csv.gz"), 
-                    #usecols=["id", "domain"], #check len
-                    dtype = DTYPES,
-                    #parse_dates = ["created_at", "author.created_at"],
-                    #nrows=1000, #check cols
-                    index_col=["id", "domain"],
-                    compression="gzip")
-
-print(f'Length of df: {len(df)}')
-
-emos = pd.read_csv(join(src, 
-                        "inference/emotion_inference.csv.gz"), 
-                    compression="gzip",
-                    usecols = ["id", "domain", #identifier
-                    "anger_v2", "fear_v2", "disgust_v2", "sadness_v2", #neg emotions
-                     "joy_v2", "enthusiasm_v2", "pride_v2", "hope_v2"], #pos emotions
-                    dtype = DTYPES,
-                    index_col=["id", "domain"],
-                    #nrows=1000
-                    )
-print(f'Length of emos: {len(emos)}')
-
-df_emos = pd.merge(df, emos, 
-                left_index=True, right_index=True, #multi-index merge
-                how="left" # left join to match inference with original df
-                ) 
-print(f'Length of merged df_emos: {len(df_emos)}')
-del df, emos
-
-df_groups = pd.read_csv(join(src, "inference/group_inference_condensed.csv.gz"), 
-                    compression="gzip",
-                    sep=";",
-                    usecols = ["id", "domain", #identifier
-                    "group", "not_out", "out"], #pos emotions
-                    dtype = DTYPES, 
-                    #nrows=1000,
-                    index_col=["id", "domain"]
-                    )
-
-df_inf = pd.merge(df_emos, df_groups, 
-                left_index=True, right_index=True, #multi-index merge
-                how="left" # left join to match inference with original df
-                ) 
-del df_groups, df_emos
-
-print(f'Length of merged df_inf: {len(df_inf)}')
-
-df_inf.to_csv(join(src, "german_newsguard_tweets_inference.csv.gz"),
-                compression="gzip", index=True)
\ No newline at end of file
+#modify columns
+def rename_column(col):
+    return col.replace("public_metrics.", "").replace("_v2", "")
+
+# Step 1: Partition the three inputs by tweet ID, unless they are partitioned already
+def file_state(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def load_state():
+    path = join(bucket_dir, "_state.json")
+    if os.path.exists(path):
+        with open(path) as file:
+            return json.load(file)
+    return {}
+
+def save_state(state):
+    with write_atomic(join(bucket_dir, "_state.json")) as tmp_path, open(tmp_path, "w") as file:
+        json.dump(state, file, indent=1)
+
+def remove_buckets(state, prefix):
+    for path in glob.glob(join(bucket_dir, f"{prefix}_*.parquet")):
+        os.remove(path)
+    state.pop(prefix, None)
+    save_state(state)
+
+def refresh(state, prefix, source, read_chunks):
+    if state.get(prefix, {}).get("source") == source:
+        print(f'Skipping {prefix}, already partitioned.')
+        return state[prefix]["rows"]
+    remove_buckets(state, prefix)
+    n_rows = partition(read_chunks(), bucket_dir, prefix, "id")
+    state[prefix] = {"source": source, "rows": n_rows}
+    save_state(state)
+    return n_rows
+
+def read_emotions(path):
+    return pd.read_csv(path, compression="gzip", usecols=KEYS + EMOTIONS,
+                       dtype=DTYPES, chunksize=chunk_size)
+
+def partition_inputs(state):
+    tweets_path = table_path(src, "german_newsguard_tweets")
+    n_tweets = refresh(state, "tweets", file_state(tweets_path),
+                       lambda: iter_table(src, "german_newsguard_tweets", batch_size=chunk_size))
+    print(f'Length of df: {n_tweets}')
+
+    # the emotion inference and each of its increments are partitioned separately
+    emotion_file = join(src, "inference/emotion_inference.csv.gz")
+    emotion_paths = result_paths(emotion_file)
+    prefixes = {("emos" if path == emotion_file else
+                 "emos-" + os.path.basename(path)[:-len(".csv.gz")]): path
+                for path in emotion_paths}
+    for prefix in [prefix for prefix in state if prefix.startswith("emos") and prefix not in prefixes]:
+        remove_buckets(state, prefix)
+    n_emos = sum(refresh(state, prefix, file_state(path), lambda path=path: read_emotions(path))
+                 for prefix, path in prefixes.items())
+    print(f'Length of emos: {n_emos}')
+
+    group_file = join(src, "inference/group_inference_condensed.csv.gz")
+    refresh(state, "groups", file_state(group_file),
+            lambda: pd.read_csv(group_file,
+                                compression="gzip",
+                                sep=";",
+                                usecols=KEYS + GROUPS,
+                                dtype=DTYPES,
+                                chunksize=chunk_size))
+    return n_tweets, list(prefixes)
+
+def empty_bucket(prefix, columns):
+    # buckets without rows are replaced by an empty frame with the right dtypes
+    files = sorted(glob.glob(join(bucket_dir, f"{prefix}_*.parquet")))
+    if not files:
+        return pd.DataFrame(columns=columns)
+    return read_table(bucket_dir, os.path.basename(files[0])[:-len(".parquet")]).iloc[:0]
+
+# Step 2: Left-join the inferences to the tweets, bucket by bucket
+def merge_buckets(writer, emotion_prefixes):
+    empty_emos = empty_bucket("emos", KEYS + EMOTIONS)
+    empty_groups = empty_bucket("groups", KEYS + GROUPS)
+
+    n_rows = 0
+    for bucket in range(N_BUCKETS):
+        df = read_bucket(bucket_dir, "tweets", bucket, None)
+        if df is None:
+            continue
+        emos = [read_bucket(bucket_dir, prefix, bucket, None) for prefix in emotion_prefixes]
+        emos = [part for part in emos if part is not None]
+        emos = pd.concat(emos, ignore_index=True) if emos else empty_emos
+        groups = read_bucket(bucket_dir, "groups", bucket, empty_groups)
+
+        # left join to match inference with original df
+        df_inf = df.merge(emos, on=KEYS, how="left")\
+                   .merge(groups, on=KEYS, how="left")
+        if len(df_inf) != len(df):
+            raise ValueError(f"Bucket {bucket}: the left join changed {len(df)} tweets "
+                             f"into {len(df_inf)} rows, (id, domain) is not unique in the inference.")
+
+        columns = KEYS + [col for col in df.columns if col not in KEYS] + EMOTIONS + GROUPS
+        writer.write(df_inf[columns].rename(columns=rename_column))
+        n_rows += len(df_inf)
+    return n_rows
+
+def main():
+    os.makedirs(bucket_dir, exist_ok=True)
+    n_tweets, emotion_prefixes = partition_inputs(load_state())
+
+    with TableWriter(src, "german_newsguard_tweets_inference") as writer:
+        n_rows = merge_buckets(writer, emotion_prefixes)
+        print(f'Length of merged df_inf: {n_rows}')
+        if n_rows != n_tweets:
+            raise ValueError(f"The merge wrote {n_rows} rows for {n_tweets} tweets.")
+
+if __name__ == "__main__":
+    main()
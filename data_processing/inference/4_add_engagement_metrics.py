@@ -1,52 +1,45 @@
+import numpy as np
 import pandas as pd
+import os
 from os.path import join
 import pickle
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import iter_table, TableWriter
+from id_index import isin_sorted, to_int64
 
+#the columns are derived chunk by chunk and stored as a sidecar of the table
+#(joined by row order when it is read), the table itself is not rewritten
 src = sys.argv[1]
+chunk_size = 500000
 
 #specify data types
 with open(join(src, "dtypes_config.pickle"), "rb") as file:
     DTYPES = pickle.load(file)
 
-#read in csv
-df = pd.read_csv(join(src, 
-                      "german_newsguard_tweets_inference.csv.gz"),
-                    compression="gzip",
-                    dtype=DTYPES,
-                    parse_dates=["created_at"],
-                    )
-
-#modify columns
-df.drop(columns=["Unnamed: 0"], inplace=True)
-df.columns = [col.replace("public_metrics.", "") 
-              if "public_metrics." in col 
-              else col for col in df.columns]
-
-df.columns = [col.replace("_v2", "") 
-              if "_v2" in col 
-              else col for col in df.columns]
+#sorted int64 conversation IDs instead of a set of strings
+conversations = np.unique(to_int64(pd.read_csv(join(src, 
+                                                    "full_conversation_ids.csv"),
+                                               dtype=DTYPES,
+                                               usecols=["conversation_id"])\
+                                   ["conversation_id"]))
+conversations = conversations[conversations >= 0]
 
 #add columns
-df["type"] = df.apply(lambda row: "starter" 
-                      if row["conversation_id"] == row["id"]
-                      else "reply", axis=1)
-
-df["status"] = "incomplete"
-df.loc[(df["type"] == "starter") & (df["reply_count"] == 0), 
-       "status"] = "complete"
-
-conversations = set(pd.read_csv(join(src, 
-                                 "full_conversation_ids.csv"),
-                            dtype=DTYPES)\
-                    ["conversation_id"])
-
+def derive_columns(df):
+    derived = pd.DataFrame(index=df.index)
+    derived["type"] = np.where(df["conversation_id"] == df["id"], "starter", "reply")
 
-df.loc[df["conversation_id"].isin(conversations), 
-       "status"] = "complete"
+    derived["status"] = "incomplete"
+    derived.loc[(derived["type"] == "starter") & (df["reply_count"] == 0), 
+                "status"] = "complete"
+    derived.loc[isin_sorted(to_int64(df["conversation_id"]), conversations), 
+                "status"] = "complete"
+    return derived
 
 #save data
-df.to_csv(join(src, 
-               "german_newsguard_tweets_inference.csv.gz"),
-            compression="gzip", 
-            index=False)
+with TableWriter(src, "german_newsguard_tweets_inference.engagement") as writer:
+    for df in iter_table(src, "german_newsguard_tweets_inference",
+                         columns=["id", "conversation_id", "reply_count"],
+                         batch_size=chunk_size):
+        writer.write(derive_columns(df))
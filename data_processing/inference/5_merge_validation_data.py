@@ -2,26 +2,19 @@ import pandas as pd
 from os.path import join
 import os
 import sys
-import pickle
 import re
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import read_table
 
 src = sys.argv[1]
 val = sys.argv[2]
 
-with open(join(src, 
-               "dtypes_config.pickle"),
-                "rb") as file:
-    DTYPES = pickle.load(file)
-
 ''' LOAD INFERENCES '''
-df_inference = pd.read_csv(join(
-                    src,
-                    "german_newsguard_tweets_inference.csv.gz"),
-                 compression="gzip",
-                 usecols=["id", 
+df_inference = read_table(src,
+                 "german_newsguard_tweets_inference",
+                 columns=["id", 
                           "anger", "fear", "disgust", "sadness", 
-                          "joy", "pride", "enthusiasm", "hope"],
-                 dtype=DTYPES
+                          "joy", "pride", "enthusiasm", "hope"]
                  )
 print(f'Inference data: {df_inference["id"].nunique()} tweets.')
 
@@ -52,15 +52,37 @@ for emotion in emotion_cols:
                         .apply(lambda x: 0 if x not in [0, 1] else x)
     
 ''' DEFINE AGREEMENT FUNCTIONS '''
-def calculate_agreement(row):
-    counts = row.value_counts()
-    max_count = counts.max() 
-    agreement_perc = (max_count / len(row)) * 100
-    return agreement_perc
-
-def take_mode(row):
-    modes = row.mode() #take the mode
-    return modes.min() #if there is a tie, take the smallest (0)
+# the labels are binary, so the mode and the agreement of two raters are
+# computed on whole arrays (one row per tweet) instead of row by row
+n_permutations = 10000
+chunk_size = 1000
+
+def take_mode(labels):
+    ones = (labels == 1).sum(axis=1)
+    zeros = (labels == 0).sum(axis=1)
+    modes = (ones > zeros).astype(float) #if there is a tie, take the smallest (0)
+    modes[ones + zeros == 0] = np.nan #no rating
+    return modes
+
+def calculate_agreement(r1, r2):
+    #percentage of the two ratings that agree, a missing rating counts as disagreement
+    agreement = np.where(r1 == r2, 100.0, 50.0)
+    return np.where(np.isnan(r1) & np.isnan(r2), np.nan, agreement)
+
+def shuffle_agreement(r1, r2):
+    #mean and std of the agreement for each shuffle of r1, the permutation
+    #matrix is built chunk by chunk with the same random draws as one
+    #np.random.permutation(r1) per shuffle
+    shuffled_means = []
+    shuffled_stds = []
+    for start in range(0, n_permutations, chunk_size):
+        n_chunk = min(chunk_size, n_permutations - start)
+        permutations = np.stack([np.random.permutation(len(r1)) 
+                                 for _ in range(n_chunk)])
+        agreement = calculate_agreement(r1[permutations], r2)
+        shuffled_means.append(np.nanmean(agreement, axis=1))
+        shuffled_stds.append(np.nanstd(agreement, axis=1, ddof=1))
+    return np.concatenate(shuffled_means), np.concatenate(shuffled_stds)
 
 ''' CALCULATE AGREEMENT FOR ALL TWEETS '''
 results_collapsed = []
@@ -79,17 +101,17 @@ for emotion in emotion_cols:
     df_all_tweets = df_all_tweets[~df_all_tweets["ID"]\
                                   .isin(df_overlap["ID"])]
     
-    df_all_tweets["R1"] = df_all_tweets[["01", "02", "03",
-                                        "04", "05", "06"]]\
-                                .apply(take_mode, axis=1)
+    df_all_tweets["R1"] = take_mode(df_all_tweets[["01", "02", "03",
+                                                   "04", "05", "06"]]\
+                                        .to_numpy(dtype=float))
     
-    df_all_tweets["R2"] = df_all_tweets[["A", "B"]]\
-                                .apply(take_mode, axis=1)
+    df_all_tweets["R2"] = take_mode(df_all_tweets[["A", "B"]]\
+                                        .to_numpy(dtype=float))
     
     df_all_tweets = df_all_tweets[["ID", "Text","R1", "R2"]]
     
-    df_all_tweets["perc_agree"] = df_all_tweets[["R1", "R2"]]\
-                                .apply(calculate_agreement, axis=1)
+    df_all_tweets["perc_agree"] = calculate_agreement(df_all_tweets["R1"].to_numpy(),
+                                                      df_all_tweets["R2"].to_numpy())
     perc_agree = df_all_tweets["perc_agree"].mean()
     perc_agree_std = df_all_tweets["perc_agree"].std()
     n_tweets = df_all_tweets["ID"].nunique()
@@ -99,25 +121,8 @@ for emotion in emotion_cols:
 
 
     ''' CHANCE AGREEMENT '''
-    shuffled_means = []
-    shuffled_stds = []
-    shuffled_lower = []
-    shuffled_upper = []
-
-    for _ in range(10000):
-        df_all_tweets["R_shuff"] = np.random.permutation(df_all_tweets["R1"])
-
-        df_all_tweets["perc_agree_shuff"] = \
-            df_all_tweets[["R_shuff", "R2"]]\
-                .apply(calculate_agreement, axis=1)
-        
-        #calculate the mean and std of each shuffled df
-        means = df_all_tweets["perc_agree_shuff"].mean()
-        std = df_all_tweets["perc_agree_shuff"].std()
-
-        #save to lists
-        shuffled_means.append(means)
-        shuffled_stds.append(std)
+    shuffled_means, shuffled_stds = shuffle_agreement(df_all_tweets["R1"].to_numpy(),
+                                                      df_all_tweets["R2"].to_numpy())
 
     #save the shuffled means
     shuffled_metrics_df = pd.DataFrame(shuffled_means, 
@@ -0,0 +1,131 @@
+import time
+IMPORT_START = time.perf_counter()
+
+import os
+import pickle
+import sys
+import torch
+import torch.nn as nn
+from transformers import AutoTokenizer, DebertaV2Config, DebertaV2Model
+
+## Notes:
+# Inference-only entry point of the fine-tuned pol_emo_mDeBERTa classifier
+# (https://github.com/tweedmann/pol_emo_mDeBERTa2/releases/tag/v.1.0.0).
+# Only torch and the DeBERTa classes are imported. The architecture is built
+# from the config on the meta device, so no pretrained weights are downloaded
+# or initialized, and the fine-tuned state dict is memory-mapped into it
+# (requires torch >= 2.1). The config is saved next to the weights on first
+# use, so later startups do not need the hub. If the lazy path fails, or with
+# ``--eager-load`` in 2_infer_emotion.py, the model is built from the
+# pretrained weights as before.
+# Startup benchmark against building the model from the pretrained weights:
+#     python emotion_model.py <model_dir>
+
+LABEL_COLUMNS = ['anger_v2', 'fear_v2', 'disgust_v2', 'sadness_v2', 'joy_v2', 'enthusiasm_v2', 'pride_v2', 'hope_v2']
+BASE_MODEL_NAME = "microsoft/mdeberta-v3-base"
+WEIGHTS_FILE = "pytorch_model.pt"
+CONFIG_FILE = "config.json"
+
+
+# scoring part of CrowdCodedTagger, with the same parameter names
+class EmotionScorer(nn.Module):
+
+  def __init__(self, config, n_classes=len(LABEL_COLUMNS)):
+    super().__init__()
+    self.bert = DebertaV2Model(config)
+    self.classifier = nn.Linear(config.hidden_size, n_classes)
+
+  def forward(self, input_ids, attention_mask):
+    output = self.bert(input_ids, attention_mask=attention_mask)
+    output = self.classifier(output.last_hidden_state[:, 0])
+    return torch.sigmoid(output)
+
+
+# Step 1: Config and tokenizer
+def load_config(model_dir):
+    config_path = os.path.join(model_dir, CONFIG_FILE)
+    if os.path.exists(config_path):
+        return DebertaV2Config.from_json_file(config_path)
+    config = DebertaV2Config.from_pretrained(BASE_MODEL_NAME)
+    config.save_pretrained(model_dir)
+    return config
+
+
+def load_tokenizer():
+    return AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+
+
+# Step 2: Build the model from the config and map the fine-tuned weights into it
+def _materialize_buffers(scorer):
+    # non-persistent buffers are not in the state dict and stay on the meta device
+    for name, param in scorer.named_parameters():
+        if param.is_meta:
+            raise ValueError(f"{name} is missing from the fine-tuned weights.")
+    for module_name, module in scorer.named_modules():
+        for name, buffer in list(module.named_buffers(recurse=False)):
+            if not buffer.is_meta:
+                continue
+            if name != "position_ids":
+                raise ValueError(f"{module_name}.{name} is missing from the fine-tuned weights.")
+            module.register_buffer(name, torch.arange(buffer.shape[-1]).expand(buffer.shape),
+                                   persistent=False)
+
+
+def load_lazy_scorer(model_dir, device="cpu"):
+    config = load_config(model_dir)
+    with torch.device("meta"):
+        scorer = EmotionScorer(config)
+    state_dict = torch.load(os.path.join(model_dir, WEIGHTS_FILE), map_location="cpu",
+                            mmap=True, weights_only=True)
+    # the fine-tuned weights may hold training-only entries, as with strict=False before
+    scorer.load_state_dict(state_dict, strict=False, assign=True)
+    _materialize_buffers(scorer)
+    return scorer.to(device).eval()
+
+
+def load_pretrained_scorer(model_dir, device="cpu"):
+    # previous (eager) startup: pretrained weights, overwritten by the fine-tuned ones
+    with torch.device("meta"):
+        scorer = EmotionScorer(load_config(model_dir))
+    scorer.bert = DebertaV2Model.from_pretrained(BASE_MODEL_NAME, return_dict=True)
+    scorer.classifier = nn.Linear(scorer.bert.config.hidden_size, len(LABEL_COLUMNS))
+    scorer.load_state_dict(torch.load(os.path.join(model_dir, WEIGHTS_FILE)), strict=False)
+    return scorer.to(device).eval()
+
+
+def load_scorer(model_dir, device="cpu", eager=False):
+    # the eager startup remains as a fallback, e.g. for weights that can not be
+    # loaded with weights_only or for torch < 2.1 (no mmap or assign); weights
+    # missing from the fine-tuned model are an error either way (ValueError)
+    if not eager:
+        try:
+            return load_lazy_scorer(model_dir, device)
+        except (TypeError, RuntimeError, pickle.UnpicklingError) as e:
+            print(f"Lazy loading failed ({e}), loading the pretrained model instead.")
+    return load_pretrained_scorer(model_dir, device)
+
+
+# Step 3: Startup benchmark
+def benchmark(model_dir):
+    print(f"Imports: {time.perf_counter() - IMPORT_START:.2f}s")
+
+    start = time.perf_counter()
+    tokenizer = load_tokenizer()
+    print(f"Tokenizer: {time.perf_counter() - start:.2f}s")
+    example = tokenizer(["Das ist ein Beispieltext."], return_tensors="pt")
+
+    for name, load in [("Lazy model", load_lazy_scorer), ("Pretrained model", load_pretrained_scorer)]:
+        start = time.perf_counter()
+        scorer = load(model_dir)
+        loaded = time.perf_counter()
+        with torch.inference_mode():
+            scores = scorer(example["input_ids"], example["attention_mask"])
+        print(f"{name}: {loaded - start:.2f}s to load, "
+              f"{time.perf_counter() - loaded:.2f}s to the first scores")
+        if name == "Lazy model":
+            lazy_scores = scores
+    print(f"Max abs difference of the scores: {(scores - lazy_scores).abs().max().item():.2e}")
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1])
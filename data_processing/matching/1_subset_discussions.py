@@ -0,0 +1,114 @@
+import gzip
+import numpy as np
+import pandas as pd
+from os.path import join
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import iter_table, table_columns
+from id_index import isin_sorted, load_index, to_int64
+from aggregation import EMOTIONS
+
+## Notes:
+# Scripted, streaming version of 1_subset_discussions.ipynb. The first pass
+# reads only the keys and finds the starters: domain tweets of type starter
+# with emotion scores and a rating (the first row of each ID). The second pass
+# routes every row of the starters' conversations to the starters, complete
+# and replies outputs, chunk by chunk. Only the columns used by the
+# aggregation (2a/2b) are read and written, and rows keep the order of the
+# table. Run in CMD:
+#     python 1_subset_discussions.py <data_dir>
+
+src = sys.argv[1]
+chunk_size = 500000
+table = "german_newsguard_tweets_inference"
+dst = join(src, "discussions")
+orientation_file = join(os.path.dirname(os.path.abspath(__file__)),
+                        "../inference/orientation_majority.csv")
+
+COLUMNS = [# tweet information
+           "id", "created_at", "type", "status", "conversation_id",
+           "domain", "Rating", "Score", "word_count",
+           # author information
+           "author_id", "author.followers_count",
+           "author.following_count", "author.tweet_count",
+           # outcome measures
+           "reply_count", "retweet_count", "like_count", "quote_count"] + EMOTIONS
+OUTPUTS = {"starters": "discussions_starters.csv.gz",
+           "complete": "discussions_complete.csv.gz",
+           "replies": "discussions_replies.csv.gz"}
+
+# Step 1: Find the starters and their conversations in one pass over the keys
+def find_starters(domains):
+    ids = [np.empty(0, dtype=np.int64)]
+    positions = [np.empty(0, dtype=np.int64)]
+    rated = [np.empty(0, dtype=bool)]
+    offset = 0
+    for chunk in iter_table(src, table,
+                            columns=["id", "type", "Rating"] + EMOTIONS,
+                            batch_size=chunk_size):
+        chunk_ids = to_int64(chunk["id"])
+        #starters among the domain tweets with emotion scores
+        candidate = chunk[EMOTIONS].notna().all(axis=1).to_numpy() & \
+                    (chunk["type"] == "starter").to_numpy() & \
+                    isin_sorted(chunk_ids, domains)
+        rows = np.flatnonzero(candidate)
+        ids.append(chunk_ids[rows])
+        positions.append(offset + rows)
+        rated.append(chunk["Rating"].notna().to_numpy()[rows])
+        offset += len(chunk)
+
+    #first row of each ID, then only the rated ones
+    ids, first = np.unique(np.concatenate(ids), return_index=True)
+    positions = np.concatenate(positions)[first]
+    rated = np.concatenate(rated)[first]
+    # starters are their own conversation
+    return np.sort(positions[rated]), ids[rated]
+
+# Step 2: Route the rows of the starters' conversations to the outputs
+def route(chunk, offset, starter_rows, conversations):
+    positions = offset + np.arange(len(chunk))
+    discussion = chunk[EMOTIONS].notna().all(axis=1).to_numpy() & \
+                 isin_sorted(to_int64(chunk["conversation_id"]), conversations)
+    complete = discussion & (chunk["status"] == "complete").to_numpy()
+    no_replies = ((chunk["type"] == "starter") & (chunk["reply_count"] == 0)).to_numpy()
+    return {"starters": isin_sorted(positions, starter_rows),
+            "complete": complete,
+            "replies": complete & ~no_replies}
+
+def main():
+    os.makedirs(dst, exist_ok=True)
+    # sorted IDs of the domain tweets, from their (memory-mapped) ID index
+    domains = load_index(src, "domain_tweets")["ids"]
+    starter_rows, conversations = find_starters(domains)
+    print(f'Number of starters: {len(starter_rows)}')
+
+    # add validated orientation ratings
+    orientation = pd.read_csv(orientation_file,
+                              usecols=["Domain", "Orientation"],
+                              dtype=str)\
+                    .drop_duplicates(subset=["Domain"])\
+                    .set_index("Domain")["Orientation"]
+
+    available = table_columns(src, table)
+    columns = [col for col in COLUMNS if col in available]
+    counts = {output: 0 for output in OUTPUTS}
+    files = {output: gzip.open(join(dst, file), "wt") for output, file in OUTPUTS.items()}
+    try:
+        offset = 0
+        for chunk in iter_table(src, table, columns=columns, batch_size=chunk_size):
+            chunk["Orientation"] = chunk["domain"].map(orientation)
+            for output, rows in route(chunk, offset, starter_rows, conversations).items():
+                chunk[rows].to_csv(files[output], header=(offset == 0), index=False)
+                counts[output] += int(rows.sum())
+            offset += len(chunk)
+    finally:
+        for file in files.values():
+            file.close()
+
+    print(f'Number of conversations: {len(conversations)}')
+    for output, count in counts.items():
+        print(f'Number of tweets in {OUTPUTS[output]}: {count}')
+
+if __name__ == "__main__":
+    main()
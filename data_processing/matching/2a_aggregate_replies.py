@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+from os.path import join
+import os
+import pickle
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from aggregation import AVG_VARIABLES, EMOTIONS, aggregate_replies
+
+## Notes:
+# Scripted version of the aggregation in 2a_aggregate_replies.ipynb (the
+# notebook keeps the distribution plots and the same-author sample). The
+# replies are aggregated per conversation in one pass (see aggregation.py)
+# and joined to the starters, which gives discussions_replies_aggregates.csv
+# and first_replies_aggregates.csv. Run in CMD:
+#     python 2a_aggregate_replies.py <data_dir>
+
+src = sys.argv[1]
+
+COLUMNS = [# tweet information
+           "id", "created_at", "type", "status", "conversation_id",
+           "domain", "Rating", "Orientation", "word_count",
+           # author information
+           "author_id", "author.followers_count",
+           "author.following_count", "author.tweet_count"] + EMOTIONS
+
+with open(join(src, "dtypes_config.pickle"), "rb") as file:
+    DTYPES = pickle.load(file)
+
+# Step 1: Recode orientation and rating
+def recode_orientation(orientation):
+    bias = pd.Series(np.nan, index=orientation.index)
+    #later labels overwrite earlier ones: Neutral before Right before Left
+    for label, value in [("Left", -1), ("Right", 1), ("Neutral", 0)]:
+        bias[orientation.str.contains(label, regex=False, na=False)] = value
+    return bias
+
+def recode_rating(rating):
+    recoded = pd.Series(np.nan, index=rating.index)
+    #later labels overwrite earlier ones: T before N
+    for label, value in [("N", 1), ("T", 0)]:
+        recoded[rating.str.contains(label, regex=False, na=False)] = value
+    return recoded
+
+# Step 2: Starters with their log-transformed covariates
+def prepare_starters(df):
+    starters = df[df["type"] == "starter"]
+    starters = starters.dropna(subset=["Rating"])\
+                       .drop_duplicates(subset=["conversation_id"])\
+                       .drop(columns=["status", "type"])
+
+    for col in ["word_count", "author.tweet_count",
+                "author.followers_count", "author.following_count"] + EMOTIONS:
+        if col in starters.columns:
+            starters[f"{col}_log"] = np.log1p(starters[col])
+    return starters
+
+def main():
+    #only the columns of the published data that are used
+    df = pd.read_csv(join(src, "discussions_replies.csv.gz"), # excluding zero-replies
+                     compression="gzip",
+                     usecols=lambda col: col in COLUMNS,
+                     dtype=DTYPES)
+    print(f'Length of df: {len(df)}')
+
+    df["Bias"] = recode_orientation(df["Orientation"])
+    df["Rating"] = recode_rating(df["Rating"])
+    starters = prepare_starters(df)
+
+    # Step 3: Aggregate all replies per conversation in one pass
+    replies = aggregate_replies(df[df["type"] == "reply"])
+    print(f'Conversations with replies: {len(replies)}')
+
+    avg_columns = [f"{col}_avg" for col in AVG_VARIABLES]
+    replies["author.tweet_count_avg_log"] = np.log1p(replies["author.tweet_count_avg"])
+    replies["time_diff_log"] = np.log1p(replies["time_diff"])
+    discussion_replies = starters.merge(replies[["conversation_id"] + avg_columns +
+                                                ["author.tweet_count_avg_log",
+                                                 "time_diff", "time_diff_log"]],
+                                        on="conversation_id",
+                                        how="inner")
+    print(f'Number of conversations: {len(discussion_replies)}')
+    n_tweets = df["conversation_id"].isin(discussion_replies["conversation_id"]).sum()
+    print(f'Number of tweets: {n_tweets}')
+    discussion_replies.to_csv(join(src, "discussions_replies_aggregates.csv"),
+                              index=False)
+
+    # Step 4: First replies, the first reply's id is kept as first_id
+    first_replies = replies[["conversation_id", "id_first", "author_id_first"] +
+                            [f"{col}_first" for col in AVG_VARIABLES]]\
+                        .rename(columns={"id_first": "first_id",
+                                         "author_id_first": "first_author_id"})
+    first_replies["author.tweet_count_first_log"] = \
+        np.log1p(first_replies["author.tweet_count_first"])
+    first_replies_avg = starters.merge(first_replies,
+                                       on="conversation_id",
+                                       how="inner")
+    print(f'Number of first replies: {len(first_replies_avg)}')
+    first_replies_avg.to_csv(join(src, "first_replies_aggregates.csv"),
+                             index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import pandas as pd
+from os.path import join
+import os
+import pickle
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from nearest_matching import compare_matches, match_mahalanobis
+from matching_datasets import DATASETS, TREATMENT, read_input
+
+## Notes:
+# Python version of the Mahalanobis matching in 3a-3c_match_*.R (see
+# nearest_matching.py): 1:1 nearest-neighbour matching of the untrustworthy
+# (Rating = 1) to the trustworthy conversations on the covariates of the R
+# formulas. The matched data is written with the R row names, weights and
+# subclass columns of match.data, so analysis/4a_boot_discussions.py reads it
+# as before. The R scripts remain for the summaries, plots and GLM matching.
+# Run in CMD:
+#     python 3_match_mahalanobis.py <data_dir> --dataset replies
+# With --validate <matched_file>, the matching is compared with an existing
+# matched file of the same input (shared matched units and pairs).
+
+parser = argparse.ArgumentParser()
+parser.add_argument("dir", help="data directory")
+parser.add_argument("--dataset", choices=list(DATASETS),
+                    default="replies")
+parser.add_argument("--caliper", type=float, default=None,
+                    help="maximum Mahalanobis distance of a pair (default: no caliper)")
+parser.add_argument("--validate", default=None,
+                    help="matched csv (e.g. from the R script) to compare with")
+args = parser.parse_args()
+
+def main():
+    dataset = DATASETS[args.dataset]
+    with open(join(args.dir, "dtypes_config.pickle"), "rb") as file:
+        DTYPES = pickle.load(file)
+
+    matching_df = read_input(args.dir, args.dataset, DTYPES)
+    print(f'Length of matching_df: {len(matching_df)}')
+
+    matched = match_mahalanobis(matching_df, TREATMENT, dataset["covariates"],
+                                caliper=args.caliper)
+    print(f'Matched pairs: {matched["subclass"].nunique()} '
+          f'of {int((matching_df[TREATMENT] == 1).sum())} treated')
+    matched.to_csv(join(args.dir, dataset["output"]))
+
+    if args.validate:
+        reference = pd.read_csv(args.validate, dtype=DTYPES)
+        comparison = compare_matches(matched, reference, "id")
+        for metric, value in comparison.items():
+            print(f'{metric}: {value}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import pandas as pd
+from os.path import join
+import os
+import pickle
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from balance import balance_report
+from matching_datasets import DATASETS, TREATMENT, read_input
+
+## Notes:
+# Balance diagnostics of a matched dataset (see balance.py), for all
+# covariates of its formula: standardized mean differences, variance ratios,
+# eCDF statistics and the correlation matrix, before and after matching.
+# Quick enough to run after every matching change. Run in CMD:
+#     python 4_balance_report.py <data_dir> <output_dir> --dataset replies
+# The matched file defaults to the Mahalanobis output of the dataset
+# (3_match_mahalanobis.py or 3a-3c_match_*.R), see --matched.
+
+parser = argparse.ArgumentParser()
+parser.add_argument("dir", help="data directory")
+parser.add_argument("dst", help="output directory")
+parser.add_argument("--dataset", choices=list(DATASETS), default="replies")
+parser.add_argument("--matched", default=None,
+                    help="matched csv in the data directory (default: the Mahalanobis output)")
+parser.add_argument("--threshold", type=float, default=0.1,
+                    help="absolute standardized mean difference reported as imbalanced")
+args = parser.parse_args()
+
+def main():
+    start = time.perf_counter()
+    dataset = DATASETS[args.dataset]
+    with open(join(args.dir, "dtypes_config.pickle"), "rb") as file:
+        DTYPES = pickle.load(file)
+
+    df = read_input(args.dir, args.dataset, DTYPES)
+    matched = pd.read_csv(join(args.dir, args.matched or dataset["output"]), dtype=DTYPES)
+
+    report, correlations = balance_report(df, matched, TREATMENT, dataset["covariates"])
+    os.makedirs(args.dst, exist_ok=True)
+    report.round(4).to_csv(join(args.dst, f"balance_{args.dataset}.csv"), index=False)
+    correlations.round(4).to_csv(join(args.dst, f"correlations_{args.dataset}.csv"))
+
+    imbalanced = report[(report["sample"] == "matched") &
+                        (report["std_mean_diff"].abs() > args.threshold)]
+    print(f'Imbalanced covariates after matching (|SMD| > {args.threshold}): '
+          f'{", ".join(imbalanced["covariate"]) or "none"}')
+    print(f'Balance report in {time.perf_counter() - start:.2f}s')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from os.path import join
+
+## Notes:
+# Inputs, outputs and covariates (the formulas of 3a-3c_match_*.R) of the
+# matched datasets, shared by the matching and balance stages. Rating = 1
+# (untrustworthy) is the treatment.
+
+TREATMENT = "Rating"
+EMOTIONS_LOG = ["anger_log", "fear_log", "disgust_log", "sadness_log",
+                "joy_log", "pride_log", "hope_log"]
+AUTHOR_LOG = ["author.followers_count_log", "author.following_count_log",
+              "author.tweet_count_log"]
+
+DATASETS = {
+    "replies": {"input": "discussions_replies_aggregates.csv",
+                "output": "matched_replies_mahalanobis.csv",
+                "covariates": ["Bias"] + EMOTIONS_LOG + ["word_count_log"] + AUTHOR_LOG +
+                              ["author.tweet_count_avg_log", "time_diff_log"],
+                "fill_missing": False},
+    "replies_first": {"input": "first_replies_aggregates.csv",
+                      "output": "matched_replies_first_mahalanobis.csv",
+                      "covariates": ["Bias"] + EMOTIONS_LOG + ["word_count_log"] + AUTHOR_LOG +
+                                    ["author.tweet_count_first_log"],
+                      "fill_missing": True},
+    "starters": {"input": "discussions_starters_aggregates.csv",
+                 "output": "matched_starters_mahalanobis.csv",
+                 "covariates": ["Bias"] + AUTHOR_LOG + ["word_count_log"] + EMOTIONS_LOG,
+                 "fill_missing": False},
+}
+
+
+def read_input(src, name, dtypes):
+    dataset = DATASETS[name]
+    df = pd.read_csv(join(src, dataset["input"]), dtype=dtypes)
+    if dataset["fill_missing"]:
+        #replace infinite values and NAs with 0, as in 3b
+        df = df.replace([np.inf, -np.inf], np.nan).fillna(0)
+    return df
@@ -0,0 +1,143 @@
+import numpy as np
+
+## Notes:
+# 1:1 nearest-neighbour matching on the Mahalanobis distance, as
+# matchit(method = "nearest", distance = "mahalanobis") in the R scripts:
+# greedy and without replacement, the treated units are matched in data order
+# and the covariance is pooled within the treatment groups. The covariates are
+# whitened by the pooled covariance, so the Mahalanobis distance becomes the
+# Euclidean distance. The nearest controls of a block of treated units are
+# found with blocked matrix products (BLAS) over chunks of the controls, which
+# keeps the memory bounded; a KD-tree does not help with the 13-14 covariates
+# of the formulas. Only the few nearest candidates of each treated unit are
+# kept, with exact distances, and the matched controls are dropped from the
+# search once half of them are taken. With a caliper, treated units whose
+# nearest available control is farther away (in Mahalanobis distance) stay
+# unmatched.
+
+BLOCK_SIZE = 1024 #treated units per distance block
+CHUNK_SIZE = 16384 #controls per distance block
+N_NEIGHBOURS = 8 #candidates kept per treated unit
+
+
+# Step 1: Whiten the covariates by the pooled within-group covariance
+def pooled_covariance(X, treated):
+    centered = X.copy()
+    for group in [treated, ~treated]:
+        centered[group] -= X[group].mean(axis=0)
+    return centered.T @ centered / (len(X) - 2)
+
+
+def whiten(X, cov):
+    # generalized inverse square root (as MASS::ginv), covariates without
+    # variance get no weight
+    values, vectors = np.linalg.eigh(cov)
+    keep = values > max(values.max(), 0) * np.sqrt(np.finfo(float).eps)
+    return X @ (vectors[:, keep] / np.sqrt(values[keep]))
+
+
+# Step 2: Greedy nearest-neighbour matching without replacement
+def _candidates(points, controls, k):
+    # k nearest controls of each point: the k nearest of each chunk of controls
+    # by blocked matrix products, then ordered by their exact distances (ties
+    # by control position)
+    # squared distances without the norms of the points (same order per point)
+    # in one product: [x, 1] @ [-2c, |c|^2]
+    augmented = np.hstack([points, np.ones((len(points), 1))])
+    nearest = []
+    for start in range(0, len(controls), CHUNK_SIZE):
+        chunk = controls[start:start + CHUNK_SIZE]
+        distances = augmented @ np.hstack([-2 * chunk, (chunk ** 2).sum(axis=1)[:, None]]).T
+        if len(chunk) > k:
+            keep = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            keep = np.broadcast_to(np.arange(len(chunk)), distances.shape)
+        nearest.append(start + keep)
+    nearest = np.sort(np.hstack(nearest), axis=1)
+
+    exact = np.sqrt(((controls[nearest] - points[:, None, :]) ** 2).sum(axis=2))
+    order = np.argsort(exact, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(nearest, order, axis=1), np.take_along_axis(exact, order, axis=1)
+
+
+def match_nearest(Z, treated, caliper=None):
+    treated_rows = np.flatnonzero(treated)
+    control_rows = np.flatnonzero(~treated)
+    taken = np.zeros(len(control_rows), dtype=bool)
+    matches = np.full(len(treated_rows), -1)
+
+    # positions of the controls that are still searched
+    available = np.arange(len(control_rows))
+    controls = Z[control_rows]
+    for start in range(0, len(treated_rows), BLOCK_SIZE):
+        if len(available) == 0:
+            break
+        block = treated_rows[start:start + BLOCK_SIZE]
+        positions, distances = _candidates(Z[block], controls,
+                                           min(N_NEIGHBOURS, len(available)))
+
+        for i, row in enumerate(block):
+            candidates = available[positions[i]]
+            free = np.flatnonzero(~taken[candidates])
+            if len(free):
+                control, distance = candidates[free[0]], distances[i, free[0]]
+            else:
+                # all candidates are matched: exact scan of the free controls
+                exact = np.sqrt(((controls - Z[row]) ** 2).sum(axis=1))
+                exact[taken[available]] = np.inf
+                nearest = np.argmin(exact)
+                if not np.isfinite(exact[nearest]):
+                    break
+                control, distance = available[nearest], exact[nearest]
+            if caliper is not None and distance > caliper:
+                continue
+            taken[control] = True
+            matches[start + i] = control
+
+        remaining = ~taken[available]
+        if remaining.sum() < len(available) / 2:
+            available = available[remaining]
+            controls = Z[control_rows[available]]
+
+    matched = matches >= 0
+    return treated_rows[matched], control_rows[matches[matched]]
+
+
+# Step 3: Matched data with weights and pair subclasses, as match.data
+def match_data(df, treated_rows, control_rows):
+    subclass = np.zeros(len(df), dtype=np.int64)
+    subclass[treated_rows] = np.arange(1, len(treated_rows) + 1)
+    subclass[control_rows] = np.arange(1, len(treated_rows) + 1)
+    rows = np.sort(np.concatenate([treated_rows, control_rows]))
+
+    matched = df.iloc[rows].copy()
+    matched["weights"] = 1.0
+    matched["subclass"] = subclass[rows]
+    # R row names of the matched units
+    matched.index = rows + 1
+    return matched
+
+
+def match_mahalanobis(df, treatment, covariates, caliper=None):
+    X = df[covariates].to_numpy(dtype=float)
+    treated = df[treatment].to_numpy() == 1
+    if np.isnan(X).any() or df[treatment].isna().any():
+        raise ValueError("Missing values are not allowed in the treatment or the covariates.")
+    Z = whiten(X, pooled_covariance(X, treated))
+    return match_data(df, *match_nearest(Z, treated, caliper))
+
+
+# Step 4: Compare two matchings of the same data
+def compare_matches(ours, theirs, key):
+    def pairs(matched):
+        keys = matched[key].astype(str)
+        groups = keys.groupby(matched["subclass"].to_numpy())
+        return set(tuple(sorted(group)) for _, group in groups)
+
+    ours_pairs, theirs_pairs = pairs(ours), pairs(theirs)
+    ours_units = set(ours[key].astype(str))
+    theirs_units = set(theirs[key].astype(str))
+    return {"matched_units": len(ours_units),
+            "matched_units_reference": len(theirs_units),
+            "shared_units": len(ours_units & theirs_units) / max(len(theirs_units), 1),
+            "shared_pairs": len(ours_pairs & theirs_pairs) / max(len(theirs_pairs), 1)}
@@ -0,0 +1,111 @@
+import glob
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from storage import write_atomic
+
+## Notes:
+# Persistent cache of the emotion scores, keyed by a 64-bit hash of the cleaned
+# text. The cache of a model lives in ``<cache_dir>/<fingerprint>/`` where the
+# fingerprint is a hash of the fine-tuned weights (plus the scoring options
+# that change the scores, e.g. quantization), so scores of another model are
+# never reused. Entries are kept as sorted uint64 keys with a float32 score
+# matrix (.npy files, memory-mapped when loaded); float32 holds the model
+# output exactly. Entries added during a run are kept in a few small sorted
+# runs next to the cache (merged with each other like a binary counter), so an
+# addition never copies the cache. Worker processes collect their new entries
+# in separate files, which are merged into the cache once by the main process.
+
+KEYS_FILE = "keys.npy"
+SCORES_FILE = "scores.npy"
+
+
+# Step 1: Keys of the texts and fingerprint of the model
+def text_keys(texts):
+    return pd.util.hash_array(np.asarray(texts, dtype=object))
+
+
+def model_fingerprint(weights_path, options=""):
+    digest = hashlib.sha256()
+    with open(weights_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 24), b""):
+            digest.update(block)
+    digest.update(options.encode())
+    return digest.hexdigest()[:16]
+
+
+# Step 2: Open the cache of a model
+def open_cache(cache_dir, fingerprint, n_scores):
+    cache = {"dir": os.path.join(cache_dir, fingerprint),
+             "keys": np.empty(0, dtype=np.uint64),
+             "scores": np.empty((0, n_scores), dtype=np.float32),
+             "runs": []}
+    if os.path.exists(os.path.join(cache["dir"], SCORES_FILE)):
+        keys = np.load(os.path.join(cache["dir"], KEYS_FILE), mmap_mode="r")
+        scores = np.load(os.path.join(cache["dir"], SCORES_FILE), mmap_mode="r")
+        # an interrupted save leaves files of different lengths, which are ignored
+        if len(keys) == len(scores):
+            cache["keys"], cache["scores"] = keys, scores
+    return cache
+
+
+# Step 3: Look up and add entries
+def _lookup_sorted(sorted_keys, sorted_scores, keys, found, scores):
+    if len(sorted_keys) == 0:
+        return
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    hit = (sorted_keys[pos] == keys) & ~found
+    scores[hit] = sorted_scores[pos[hit]]
+    found |= hit
+
+
+def lookup(cache, keys):
+    # scores of the cached keys (float64), NaN rows for the others
+    scores = np.full((len(keys), cache["scores"].shape[1]), np.nan)
+    found = np.zeros(len(keys), dtype=bool)
+    for run_keys, run_scores in [(cache["keys"], cache["scores"])] + cache["runs"]:
+        _lookup_sorted(run_keys, run_scores, keys, found, scores)
+    return found, scores
+
+
+def add(cache, keys, scores):
+    # keys are unique and not in the cache yet; they form a new run, and runs of
+    # similar size are merged, so there are only O(log n) runs
+    order = np.argsort(keys, kind="stable")
+    cache["runs"].append((keys[order], scores[order].astype(np.float32)))
+    runs = cache["runs"]
+    while len(runs) > 1 and len(runs[-2][0]) <= 2 * len(runs[-1][0]):
+        (keys_a, scores_a), (keys_b, scores_b) = runs.pop(-2), runs.pop()
+        merged_keys = np.concatenate([keys_a, keys_b])
+        order = np.argsort(merged_keys, kind="stable")
+        runs.append((merged_keys[order], np.concatenate([scores_a, scores_b])[order]))
+
+
+# Step 4: Save new entries of a worker, and merge them into the cache
+def save_entries(path, keys, scores):
+    with write_atomic(path) as tmp_path, open(tmp_path, "wb") as file:
+        np.savez(file, keys=keys, scores=scores.astype(np.float32))
+
+
+def merge_entries(cache, pattern):
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        return
+    keys = [np.asarray(cache["keys"])]
+    scores = [np.asarray(cache["scores"])]
+    for path in paths:
+        with np.load(path) as entries:
+            keys.append(entries["keys"])
+            scores.append(entries["scores"])
+    keys, first = np.unique(np.concatenate(keys), return_index=True)
+    cache["keys"], cache["scores"] = keys, np.concatenate(scores)[first]
+    cache["runs"] = [] #the entries of the run are in the files
+
+    os.makedirs(cache["dir"], exist_ok=True)
+    for name, values in [(KEYS_FILE, cache["keys"]), (SCORES_FILE, cache["scores"])]:
+        with write_atomic(os.path.join(cache["dir"], name)) as tmp_path, open(tmp_path, "wb") as file:
+            np.save(file, values)
+    for path in paths:
+        os.remove(path)
+    print(f"Score cache holds {len(cache['keys'])} texts.")
@@ -0,0 +1,288 @@
+import glob
+import gzip
+import json
+import os
+import sys
+from contextlib import ExitStack, contextmanager
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+## Notes:
+# Shared storage layer for the data_wrangling and inference stages. Tables are
+# saved as Parquet (``<src>/<name>.parquet``, or a partitioned directory
+# ``<src>/<name>/year=.../``) with the pandas dtypes embedded in the schema,
+# so every stage reads only the columns it needs (decompressed in parallel by
+# Arrow) instead of re-parsing the full gzip csv with ``dtypes_config.pickle``.
+# Gzip csv is only produced as an optional export for the notebooks:
+#     python storage.py <src> <name>
+# Columns derived by a later stage can be stored as a sidecar table
+# (``<src>/<name>.<sidecar>.parquet``, written with the same row order), which is
+# joined to the table by row order when it is read, so the stage does not
+# rewrite the unchanged columns. Rewriting a table removes its sidecars.
+# Every file of the pipeline is written through ``write_atomic``: to a hidden
+# temporary file next to it (ignored by Parquet readers), which is renamed once
+# it is complete, so a crash never leaves half a file.
+
+DTYPES_KEY = b"pandas_dtypes"
+BATCH_SIZE = 500000
+COMMON_SCHEMA = "_common_metadata" #schema of a partitioned table
+
+
+@contextmanager
+def write_atomic(path):
+    # yields the temporary path to write to; on an error it is removed and
+    # the file at path is left as it was
+    tmp_path = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+    if os.path.exists(tmp_path): #left over by an interrupted run
+        os.remove(tmp_path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def table_path(src, name):
+    path = os.path.join(src, name)
+    return path if os.path.isdir(path) else path + ".parquet"
+
+
+def _open_dataset(src, name):
+    path = table_path(src, name)
+    if not os.path.isdir(path):
+        return ds.dataset(path, format="parquet")
+
+    # partition keys (e.g. year=2020/round=initial) are read back as strings
+    files = sorted(glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True))
+    keys = [part.split("=")[0] for part in
+            os.path.relpath(files[0], path).split(os.sep)[:-1]] if files else []
+    partition_schema = pa.schema([(key, pa.string()) for key in keys])
+    partitioning = ds.partitioning(partition_schema, flavor="hive")
+
+    # the files of a partitioned table are read with its common schema, if
+    # one is stored, instead of the schema of the first file
+    schema = None
+    common_path = os.path.join(path, COMMON_SCHEMA)
+    if os.path.exists(common_path):
+        schema = pq.read_schema(common_path)
+        for field in partition_schema:
+            if field.name not in schema.names:
+                schema = schema.append(field)
+    return ds.dataset(path, format="parquet", partitioning=partitioning, schema=schema)
+
+
+def _restore_dtypes(df, schema):
+    # re-apply the embedded pandas dtypes where Arrow chose another one
+    if schema.metadata is None or DTYPES_KEY not in schema.metadata:
+        return df
+    dtypes = json.loads(schema.metadata[DTYPES_KEY])
+    restore = {col: dtype for col, dtype in dtypes.items()
+               if col in df.columns and str(df[col].dtype) != dtype}
+    return df.astype(restore) if restore else df
+
+
+def _string_nulls(arrow_type):
+    # all-missing columns (or categories) are stored as strings
+    if pa.types.is_null(arrow_type):
+        return pa.string()
+    if pa.types.is_dictionary(arrow_type) and pa.types.is_null(arrow_type.value_type):
+        return pa.dictionary(arrow_type.index_type, pa.string(), arrow_type.ordered)
+    return arrow_type
+
+
+def pandas_schema(df):
+    # Arrow schema of a frame, with its pandas dtypes embedded
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    schema = pa.schema([field.with_type(_string_nulls(field.type)) for field in schema])
+    dtypes = {col: str(dtype) for col, dtype in df.dtypes.items()}
+    return schema.with_metadata({**(schema.metadata or {}),
+                                 DTYPES_KEY: json.dumps(dtypes).encode()})
+
+
+def write_common_schema(src, name, schema):
+    # stored once for a partitioned table, see _open_dataset
+    with write_atomic(os.path.join(table_path(src, name), COMMON_SCHEMA)) as tmp_path:
+        pq.write_metadata(schema, tmp_path)
+
+
+def table_schema(src, name):
+    return _open_dataset(src, name).schema
+
+
+def sidecar_paths(src, name):
+    return sorted(glob.glob(os.path.join(glob.escape(src), glob.escape(name) + ".*.parquet")))
+
+
+def table_columns(src, name):
+    # columns of the table followed by those of its sidecars
+    columns = list(table_schema(src, name).names)
+    for path in sidecar_paths(src, name):
+        columns += ds.dataset(path, format="parquet").schema.names
+    return columns
+
+
+def _sidecars(src, name, dataset, columns):
+    # sidecar datasets of a table with the requested columns they hold
+    sidecars = []
+    for path in sidecar_paths(src, name):
+        sidecar = ds.dataset(path, format="parquet")
+        clash = set(sidecar.schema.names) & set(dataset.schema.names)
+        if clash:
+            raise ValueError(f"Sidecar {path} repeats columns of {name}: {sorted(clash)}")
+        cols = [col for col in sidecar.schema.names if columns is None or col in columns]
+        if not cols:
+            continue
+        if sidecar.count_rows() != dataset.count_rows():
+            raise ValueError(f"Sidecar {path} does not have the rows of {name}.")
+        sidecars.append((sidecar, cols))
+    return sidecars
+
+
+def _main_columns(dataset, columns):
+    return None if columns is None else [col for col in columns if col in dataset.schema.names]
+
+
+def _join_sidecars(table, sides, columns):
+    for sidecar, side in sides:
+        for col in side.column_names:
+            table = table.append_column(sidecar.schema.field(col), side.column(col))
+    return table if columns is None else table.select(columns)
+
+
+def _to_pandas(table, dataset, sidecars):
+    df = _restore_dtypes(table.to_pandas(), dataset.schema)
+    for sidecar, _ in sidecars:
+        df = _restore_dtypes(df, sidecar.schema)
+    return df
+
+
+class _RowReader:
+    # hands out the rows of a batch iterator in slices of any length
+
+    def __init__(self, batches, schema):
+        self.batches = iter(batches)
+        self.schema = schema
+        self.buffer = []
+        self.buffered = 0
+
+    def take(self, n_rows):
+        while self.buffered < n_rows:
+            batch = next(self.batches)
+            self.buffer.append(batch)
+            self.buffered += batch.num_rows
+        table = pa.Table.from_batches(self.buffer, schema=self.schema)
+        self.buffer = table.slice(n_rows).to_batches()
+        self.buffered -= n_rows
+        return table.slice(0, n_rows)
+
+
+# Step 1: Read a full table, or only some of its columns
+def read_table(src, name, columns=None, filter=None):
+    dataset = _open_dataset(src, name)
+    sidecars = _sidecars(src, name, dataset, columns)
+    if not sidecars:
+        table = dataset.to_table(columns=columns, filter=filter)
+        return _restore_dtypes(table.to_pandas(), dataset.schema)
+
+    # rows are only filtered once the sidecars are joined
+    table = dataset.to_table(columns=_main_columns(dataset, columns))
+    table = _join_sidecars(table, [(sidecar, sidecar.to_table(columns=cols))
+                                   for sidecar, cols in sidecars], None)
+    if filter is not None:
+        table = table.filter(filter)
+    if columns is not None:
+        table = table.select(columns)
+    return _to_pandas(table, dataset, sidecars)
+
+
+# Step 2: Read a table chunk by chunk
+def iter_table(src, name, columns=None, batch_size=BATCH_SIZE):
+    dataset = _open_dataset(src, name)
+    sidecars = _sidecars(src, name, dataset, columns)
+    if not sidecars:
+        for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+            yield _restore_dtypes(batch.to_pandas(), dataset.schema)
+        return
+
+    readers = [(sidecar, _RowReader(sidecar.to_batches(columns=cols, batch_size=batch_size),
+                                    pa.schema([sidecar.schema.field(col) for col in cols])))
+               for sidecar, cols in sidecars]
+    for batch in dataset.to_batches(columns=_main_columns(dataset, columns),
+                                    batch_size=batch_size):
+        table = _join_sidecars(pa.Table.from_batches([batch]),
+                               [(sidecar, reader.take(batch.num_rows))
+                                for sidecar, reader in readers], columns)
+        yield _to_pandas(table, dataset, sidecars)
+
+
+# Step 3: Write a table incrementally, chunk by chunk
+class TableWriter:
+
+    def __init__(self, src, name, schema=None):
+        self.src, self.name = src, name
+        self.path = os.path.join(src, name + ".parquet")
+        self.schema = schema
+        self.writer = None
+        # the table is renamed into place once it is complete, see write_atomic
+        self.atomic = ExitStack()
+
+    def write(self, df):
+        if self.writer is None:
+            if self.schema is None:
+                self.schema = pandas_schema(df)
+            else:
+                dtypes = {col: str(dtype) for col, dtype in df.dtypes.items()}
+                self.schema = self.schema.with_metadata(
+                    {**(self.schema.metadata or {}),
+                     DTYPES_KEY: json.dumps(dtypes).encode()})
+            tmp_path = self.atomic.enter_context(write_atomic(self.path))
+            self.writer = pq.ParquetWriter(tmp_path, self.schema,
+                                           compression="zstd")
+
+        # align the chunk to the columns of the table, missing columns are
+        # filled with typed nulls
+        present = [field for field in self.schema if field.name in df.columns]
+        table = pa.Table.from_pandas(df[[field.name for field in present]],
+                                     schema=pa.schema(present),
+                                     preserve_index=False)
+        arrays = [table.column(field.name) if field in present
+                  else pa.nulls(len(df), field.type) for field in self.schema]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.atomic.close()
+            # sidecars of the previous table no longer match its rows
+            for path in sidecar_paths(self.src, self.name):
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.writer is not None:
+            self.writer.close()
+            self.atomic.__exit__(exc_type, exc, tb)
+
+
+def write_table(src, name, df):
+    with TableWriter(src, name) as writer:
+        writer.write(df)
+
+
+# Step 4: Optional export to one gzip csv
+def export_csv(src, name, output_file=None):
+    output_file = output_file or os.path.join(src, name + ".csv.gz")
+    with write_atomic(output_file) as tmp_path, gzip.open(tmp_path, "wt") as file:
+        for i, chunk in enumerate(iter_table(src, name)):
+            chunk.to_csv(file, header=(i == 0), index=False)
+    print(f"Exported {name} to {output_file}.")
+
+
+if __name__ == "__main__":
+    export_csv(sys.argv[1], sys.argv[2])
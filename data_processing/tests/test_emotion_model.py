@@ -0,0 +1,47 @@
+import os
+import sys
+import pytest
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+from transformers import DebertaV2Config
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "inference"))
+from emotion_model import CONFIG_FILE, WEIGHTS_FILE, EmotionScorer, load_lazy_scorer, load_scorer
+
+
+def tiny_scorer(model_dir):
+    torch.manual_seed(0)
+    config = DebertaV2Config(vocab_size=100, hidden_size=32, num_hidden_layers=2,
+                             num_attention_heads=2, intermediate_size=64,
+                             max_position_embeddings=64, relative_attention=True,
+                             position_buckets=16, pos_att_type=["p2c", "c2p"])
+    config.to_json_file(os.path.join(model_dir, CONFIG_FILE))
+    return EmotionScorer(config).eval()
+
+
+# older checkpoints hold the position_ids buffer, newer ones do not
+@pytest.mark.parametrize("position_ids", [False, True])
+def test_lazy_scorer_matches_the_saved_model(tmp_path, position_ids):
+    scorer = tiny_scorer(tmp_path)
+    state_dict = scorer.state_dict()
+    if position_ids:
+        state_dict["bert.embeddings.position_ids"] = torch.arange(64).expand((1, -1))
+    torch.save(state_dict, os.path.join(tmp_path, WEIGHTS_FILE))
+
+    lazy = load_lazy_scorer(tmp_path)
+    assert not any(tensor.is_meta for tensor in list(lazy.parameters()) + list(lazy.buffers()))
+    input_ids = torch.randint(0, 100, (3, 12))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[0, 8:] = 0
+    with torch.inference_mode():
+        expected = scorer(input_ids, attention_mask)
+        scores = lazy(input_ids, attention_mask)
+    assert torch.allclose(scores, expected)
+
+
+def test_missing_weights_are_not_loaded_eagerly(tmp_path):
+    state_dict = tiny_scorer(tmp_path).state_dict()
+    del state_dict["classifier.weight"]
+    torch.save(state_dict, os.path.join(tmp_path, WEIGHTS_FILE))
+
+    with pytest.raises(ValueError, match="classifier.weight is missing"):
+        load_scorer(tmp_path)
@@ -0,0 +1,16 @@
+import numpy as np
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from id_index import isin_sorted, to_int64
+
+
+def test_to_int64_keeps_long_ids_next_to_missing():
+    ids = ["1234567890123456789", np.nan, "not an id", "1234567890123456790"]
+    assert to_int64(ids).tolist() == [1234567890123456789, -1, -1, 1234567890123456790]
+
+
+def test_isin_sorted_separates_adjacent_ids():
+    keys = np.sort(to_int64(["1234567890123456789", None]))
+    found = isin_sorted(to_int64(["1234567890123456788", "1234567890123456789"]), keys)
+    assert found.tolist() == [False, True]
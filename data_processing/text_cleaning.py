@@ -0,0 +1,101 @@
+import re
+import sys
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+from storage import iter_table
+
+## Notes:
+# Cleaning of the tweet texts before inference. The patterns are compiled once
+# and applied to whole pyarrow string arrays (RE2 in Arrow), in the same order
+# as the per-tweet Python passes they replace, so ``text_cleaned`` stays
+# identical. RE2's ``\w`` only covers ASCII while Python's covers Unicode
+# letters and digits: the few texts where an @-handle runs into a non-ASCII
+# character are cleaned with the Python patterns instead.
+# Benchmark against the Python passes on the German tweets of a table:
+#     python text_cleaning.py <src> [<name>]
+
+EMOJI_RANGES = [("1F600", "1F64F"),  # emoticons
+                ("1F300", "1F5FF"),  # symbols & pictographs
+                ("1F680", "1F6FF"),  # transport & map symbols
+                ("1F700", "1F77F"),  # alchemical symbols
+                ("1F780", "1F7FF"),  # Geometric Shapes Extended
+                ("1F800", "1F8FF"),  # Supplemental Arrows-C
+                ("1F900", "1F9FF"),  # Supplemental Symbols and Pictographs
+                ("1FA00", "1FA6F"),  # Chess Symbols
+                ("1FA70", "1FAFF"),  # Symbols and Pictographs Extended-A
+                ("2702", "27B0"),    # Dingbats
+                ("24C2", "1F251")]
+
+# Python patterns
+EMOJI_PATTERN = re.compile("[" + "".join(chr(int(start, 16)) + "-" + chr(int(end, 16))
+                                         for start, end in EMOJI_RANGES) + "]+",
+                           flags=re.UNICODE)
+LINK_PATTERN = re.compile("https.*")
+HANDLE_PATTERN = re.compile(r"@\w+")
+
+# RE2 patterns for pyarrow
+EMOJI_RE2 = "[" + "".join(f"\\x{{{start}}}-\\x{{{end}}}"
+                          for start, end in EMOJI_RANGES) + "]+"
+LINK_RE2 = "https.*"
+HANDLE_RE2 = "@[A-Za-z0-9_]+"
+# handles where RE2's and Python's \w could disagree
+NON_ASCII_HANDLE_RE2 = "@[A-Za-z0-9_]*[^\\x00-\\x7F]"
+
+
+def _clean_handles(item):
+    item = HANDLE_PATTERN.sub("", item) # remove @-handles
+    item = item.replace('\\n', ' ') # remove line breaks
+    return item.replace('\\', '') # remove backslash
+
+
+# Step 1: Reference cleaning of a single text with the Python patterns
+def clean_text(item):
+    item = EMOJI_PATTERN.sub("", item) # remove emojis
+    item = LINK_PATTERN.sub("", item) # remove links
+    return _clean_handles(item)
+
+
+# Step 2: Vectorized cleaning of a string array
+def clean_texts(texts):
+    texts = pa.array(texts, type=pa.string()) if not isinstance(texts, pa.Array) \
+        else texts.cast(pa.string())
+    texts = pc.replace_substring_regex(texts, EMOJI_RE2, "") # remove emojis
+    texts = pc.replace_substring_regex(texts, LINK_RE2, "") # remove links
+
+    unicode_handles = pc.fill_null(pc.match_substring_regex(texts, NON_ASCII_HANDLE_RE2),
+                                   False)
+    cleaned = pc.replace_substring_regex(texts, HANDLE_RE2, "") # remove @-handles
+    cleaned = pc.replace_substring(cleaned, "\\n", " ") # remove line breaks
+    cleaned = pc.replace_substring(cleaned, "\\", "") # remove backslash
+    if not pc.any(unicode_handles).as_py():
+        return cleaned
+
+    fallback = pc.filter(texts, unicode_handles).to_pylist()
+    fallback = pa.array([_clean_handles(item) for item in fallback], type=pa.string())
+    return pc.replace_with_mask(cleaned, unicode_handles, fallback)
+
+
+# Step 3: Benchmark the vectorized cleaning against the Python passes
+def benchmark(src, name="german_newsguard_tweets"):
+    texts = pa.chunked_array([pa.array(chunk.loc[chunk["lang"] == "de", "text"],
+                                       type=pa.string())
+                              for chunk in iter_table(src, name, columns=["lang", "text"])],
+                             type=pa.string()).combine_chunks()
+    texts = pc.drop_null(texts)
+
+    start = time.perf_counter()
+    reference = [clean_text(item) for item in texts.to_pylist()]
+    python_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cleaned = clean_texts(texts).to_pylist()
+    arrow_time = time.perf_counter() - start
+
+    print(f'Identical output: {cleaned == reference}')
+    print(f'Python: {len(texts) / python_time:,.0f} rows/s')
+    print(f'Arrow: {len(texts) / arrow_time:,.0f} rows/s ({python_time / arrow_time:.1f}x)')
+
+
+if __name__ == "__main__":
+    benchmark(*sys.argv[1:3])